@@ -42,6 +42,8 @@ import threading
 import numpy as np
 import sklearn.cluster
 
+import audio_io
+
 class PopFormatError(Exception):
     pass
 
@@ -127,7 +129,7 @@ class InfiniteJukebox(object):
 
     """
 
-    def __init__(self, filename, start_beat=1, clusters=0, progress_callback=None, async=False):
+    def __init__(self, filename, start_beat=1, clusters=0, progress_callback=None, async=False, offset=0.0, duration=None):
 
         """ The constructor for the class. Also starts the processing thread.
 
@@ -147,9 +149,13 @@ class InfiniteJukebox(object):
 
                              percent_complete: FLOAT between 0.0 and 1.0
                                       message: STRING with the progress message
+                  offset: where in the file (secs) to start analysing
+                duration: how much of the file (secs) to analyse, None for all of it
         """
         self.__progress_callback = progress_callback
         self.__filename = filename
+        self.__offset = offset
+        self.__duration = duration
         self.__start_beat = start_beat
         self.clusters = clusters
         self._extra_diag = ""
@@ -183,7 +189,7 @@ class InfiniteJukebox(object):
         # trim the silences from each end
         #
 
-        y, sr = librosa.core.load(self.__filename, mono=True, sr=22050)
+        y, sr = audio_io.load(self.__filename, mono=True, sr=22050, offset=self.__offset, duration=self.__duration)
         y, _ = librosa.effects.trim(y)
 
         self.duration = librosa.core.get_duration(y,sr)
@@ -205,6 +211,7 @@ class InfiniteJukebox(object):
 
         cqt = librosa.cqt(y=y, sr=sr, bins_per_octave=BINS_PER_OCTAVE, n_bins=N_OCTAVES * BINS_PER_OCTAVE)
         C = librosa.amplitude_to_db( cqt, ref=np.max)
+        del cqt
 
         self.__report_progress( .3, "Finding beats..." )
 
@@ -212,6 +219,8 @@ class InfiniteJukebox(object):
         # To reduce dimensionality, we'll beat-synchronous the CQT
         tempo, beats = librosa.beat.beat_track(y=y, sr=sr, trim=False)
         Csync = librosa.util.sync(C, beats, aggregate=np.median)
+        n_frames = C.shape[1]
+        del C
 
         self.tempo = tempo
 
@@ -219,7 +228,7 @@ class InfiniteJukebox(object):
         # we fix_frames to include non-beat frames 0 and C.shape[1] (final frame)
         beat_times = librosa.frames_to_time(librosa.util.fix_frames(beats,
                                                                     x_min=0,
-                                                                    x_max=C.shape[1]),
+                                                                    x_max=n_frames),
                                             sr=sr)
 
         self.__report_progress( .4, "building recurrence matrix..." )
@@ -0,0 +1,209 @@
+#####################################
+# Music Signaling Pipeline Prototype
+#   Audio IO: one decode/ resample
+#   layer for every track load
+#
+# Author: Ishwarya Ananthabhotla
+######################################
+
+# WAV/ FLAC/ OGG/ AIFF are read straight through libsndfile when the
+# soundfile package is installed; everything else (and everything, without
+# soundfile) goes through librosa's audioread path. Resampling quality is
+# set once with resample_quality and can be overridden per call.
+
+import os
+import time
+from fractions import gcd
+
+import audioread
+import numpy as np
+import librosa
+
+# soundfile raises OSError at import when libsndfile itself is missing
+try:
+    import soundfile
+except (ImportError, OSError):
+    soundfile = None
+
+SNDFILE_EXTENSIONS = ['.wav', '.flac', '.ogg', '.aif', '.aiff']
+
+# quality name -> librosa res_type
+RES_TYPES = {'best': 'kaiser_best', 'fast': 'kaiser_fast', 'scipy': 'scipy'}
+resample_quality = 'fast'
+
+# backend -> [seconds of audio decoded, wall-clock seconds spent]
+decode_stats = {}
+
+# full scale of int16 playback storage
+INT16_SCALE = 1.0 / np.iinfo(np.int16).max
+
+
+def res_type(quality=None):
+    return RES_TYPES[quality or resample_quality]
+
+def backend(track_name):
+    if soundfile is not None and os.path.splitext(track_name)[1].lower() in SNDFILE_EXTENSIONS:
+        return 'soundfile'
+    return 'audioread'
+
+def record(backend_name, audio_secs, wall_secs):
+    totals = decode_stats.setdefault(backend_name, [0.0, 0.0])
+    totals[0] += audio_secs
+    totals[1] += wall_secs
+
+def report():
+    for backend_name, (audio_secs, wall_secs) in sorted(decode_stats.items()):
+        print "Decode (%s): %.1fs of audio in %.2fs, %.0fx realtime" % (backend_name, audio_secs, wall_secs, audio_secs / max(wall_secs, 1e-6))
+
+def duration(track_name):
+    if backend(track_name) == 'soundfile':
+        return soundfile.info(track_name).duration
+    with audioread.audio_open(track_name) as f:
+        return f.duration
+
+# compact playback storage: int16 holds a float32 track in half the memory
+def to_int16(y):
+    return (np.clip(y, -1.0, 1.0) * np.iinfo(np.int16).max).astype(np.int16)
+
+# always a new float32 array, whatever y is stored as
+def to_float32(y):
+    if y.dtype == np.int16:
+        return np.multiply(y, INT16_SCALE, dtype=np.float32)
+    return np.array(y, dtype=np.float32)
+
+# (sample rate, channels) of the file as stored
+def native_format(track_name):
+    if backend(track_name) == 'soundfile':
+        info = soundfile.info(track_name)
+        return info.samplerate, info.channels
+    with audioread.audio_open(track_name) as f:
+        return f.samplerate, f.channels
+
+
+# drop-in for librosa.load: (channels, n) or (n,) float32 at sr
+# (sr=None keeps the native rate)
+def load(track_name, sr=22050, mono=True, offset=0.0, duration=None, quality=None):
+    start_time = time.time()
+    backend_name = backend(track_name)
+
+    if backend_name == 'soundfile':
+        with soundfile.SoundFile(track_name) as f:
+            sr_native = f.samplerate
+            f.seek(int(round(offset * sr_native)))
+            frames = -1 if duration is None else int(round(duration * sr_native))
+            y = f.read(frames=frames, dtype='float32', always_2d=True).T
+
+        if mono:
+            y = librosa.to_mono(y)
+        elif y.shape[0] == 1:
+            y = y[0]
+
+        if sr is not None and sr != sr_native:
+            y = librosa.resample(y, sr_native, sr, res_type=res_type(quality))
+        else:
+            sr = sr_native
+    else:
+        y, sr = librosa.load(track_name, sr=sr, mono=mono, offset=offset, duration=duration, res_type=res_type(quality))
+
+    record(backend_name, y.shape[-1] / float(sr), time.time() - start_time)
+    return y, sr
+
+
+###################################
+# STREAMING
+###################################
+
+# resample [core_start, core_stop) of the native stream held in buf, using
+# pad native samples of context either side
+def resample_core(buf, buf_start, core_start, core_stop, pad, sr_native, sr, quality=None, n_out=None):
+    start = max(0, core_start - pad)
+    stop = min(buf_start + len(buf), core_stop + pad)
+    y = librosa.resample(buf[start - buf_start: stop - buf_start], sr_native, sr, res_type=res_type(quality), fix=False)
+
+    # core_start and start are multiples of the rate period, so this is exact
+    offset = (core_start - start) * sr // sr_native
+    if n_out is None:
+        n_out = (core_stop - core_start) * sr // sr_native
+    return librosa.util.fix_length(y[offset: offset + n_out], n_out)
+
+# (native rate, mono float32 chunks) from the fastest backend
+def native_chunks(track_name, block_frames=65536):
+    if backend(track_name) == 'soundfile':
+        sr_native = soundfile.info(track_name).samplerate
+        blocks = soundfile.blocks(track_name, blocksize=block_frames, dtype='float32', always_2d=True)
+        return sr_native, (b.mean(axis=1) for b in blocks)
+
+    f = audioread.audio_open(track_name)
+
+    def chunks():
+        with f:
+            for buf in f:
+                y = librosa.util.buf_to_float(buf, dtype=np.float32)
+                if f.channels > 1:
+                    y = y.reshape((-1, f.channels)).mean(axis=1)
+                yield y
+
+    return f.samplerate, chunks()
+
+# mono float32 chunks of the track at sr, in order, never holding more than
+# chunk_secs (plus context) of decoded audio; decode_stats only counts time
+# spent in here, not in the consumer
+def stream(track_name, sr=22050, quality=None, chunk_secs=10.0, context=4096):
+    busy = 0.0
+    resumed = time.time()
+    sr_native, chunks = native_chunks(track_name)
+
+    if sr_native == sr:
+        n = 0
+        for chunk in chunks:
+            n += len(chunk)
+            busy += time.time() - resumed
+            yield chunk
+            resumed = time.time()
+        record(backend(track_name), n / float(sr), busy + time.time() - resumed)
+        return
+
+    period = sr_native // gcd(sr_native, sr)
+    step = int(np.ceil(chunk_secs * sr_native / period)) * period
+    pad = int(np.ceil(context / float(period))) * period
+
+    buf = np.zeros(0, dtype=np.float32)
+    buf_start = 0
+    core_start = 0
+    pending = []
+    pending_len = 0
+
+    for chunk in chunks:
+        pending.append(chunk)
+        pending_len += len(chunk)
+        if buf_start + len(buf) + pending_len < core_start + step + pad:
+            continue
+
+        buf = np.concatenate([buf] + pending)
+        pending = []
+        pending_len = 0
+
+        while buf_start + len(buf) >= core_start + step + pad:
+            out = resample_core(buf, buf_start, core_start, core_start + step, pad, sr_native, sr, quality)
+            core_start += step
+
+            # drop what no later chunk needs as context
+            drop = max(0, core_start - pad) - buf_start
+            buf = buf[drop:]
+            buf_start += drop
+
+            busy += time.time() - resumed
+            yield out
+            resumed = time.time()
+
+    buf = np.concatenate([buf] + pending)
+    n = buf_start + len(buf)
+    if core_start < n:
+        # librosa.load rounds the resampled length up
+        n_out = int(np.ceil(n * float(sr) / sr_native)) - core_start * sr // sr_native
+        out = resample_core(buf, buf_start, core_start, n, pad, sr_native, sr, quality, n_out)
+        busy += time.time() - resumed
+        yield out
+        resumed = time.time()
+
+    record(backend(track_name), n / float(sr_native), busy + time.time() - resumed)
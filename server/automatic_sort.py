@@ -10,6 +10,8 @@
 import librosa
 import numpy as np
 import Remixatron as R
+import parallel_dsp as pdsp
+import audio_io
 
 
 class Automatic_Sorting():
@@ -17,6 +19,9 @@ class Automatic_Sorting():
         self.genre_dict = {'classical':['classical','rhythmless-instrumental', 'choir', 'avant-garde', 'soundtrack'], 'pop':['pop','country', 'folk', 'latin', 'gospel'], 
         'blues':['blues','rock', 'hip-hop', 'R&B', 'soul', 'strong-rhythmic', 'disco', 'rap'], 'jazz':['jazz','rhythmic-instrumental', 'electronic', 'easy-listening']}
 
+        # classification report per track name, filled in by categorize_audio
+        self.reports = {}
+
     # see if the selected label remaps to any existing bucket
     def genre_mapping(self, genre_label):
         for category in self.genre_dict.keys():
@@ -25,12 +30,16 @@ class Automatic_Sorting():
 
         return ""
 
-    def is_rhythmic(self, track_audio, sr, threshold=0.4, heavy_threshold=0.7, success_percentage=0.5, heavy_percentage=0.25):
-        harm, perc = librosa.effects.hpss(track_audio, margin=(1.0, 5.0))
+    # fraction of beats landing on a strong/ heavy percussive onset
+    def rhythm_ratios(self, track_audio, sr, threshold=0.4, heavy_threshold=0.7):
+        harm, perc = pdsp.hpss(track_audio, sr, margin=(1.0, 5.0))
 
-        onset_env = librosa.onset.onset_strength(perc, sr=sr)
-        tempo, beats = librosa.beat.beat_track(y=perc, sr=sr)
+        log_mel = pdsp.log_melspectrogram(perc, sr)
+        onset_env = pdsp.onset_strength(S=log_mel, sr=sr)
+        # same envelope beat_track(y=perc) would compute for itself
+        tempo, beats = librosa.beat.beat_track(onset_envelope=pdsp.onset_strength(S=log_mel, sr=sr, aggregate=np.median), sr=sr)
         times = librosa.frames_to_time(np.arange(len(onset_env)), sr=sr, hop_length=512)
+        norm_onset_env = librosa.util.normalize(onset_env)
 
         num_strong_beats = 0
         num_heavy_beats = 0
@@ -39,15 +48,19 @@ class Automatic_Sorting():
             # get the corresponding onset env value
             t_b = times[b]
             on_f_b = librosa.time_to_frames([t_b], sr=sr)
-            if librosa.util.normalize(onset_env)[on_f_b] >= threshold:
+            if norm_onset_env[on_f_b] >= threshold:
                 num_strong_beats += 1
-                if librosa.util.normalize(onset_env)[on_f_b] >= heavy_threshold:
+                if norm_onset_env[on_f_b] >= heavy_threshold:
                     num_heavy_beats +=1
 
+        return (num_strong_beats, num_heavy_beats, len(beats), tempo)
+
+    def is_rhythmic(self, track_audio, sr, threshold=0.4, heavy_threshold=0.7, success_percentage=0.5, heavy_percentage=0.25):
+        num_strong_beats, num_heavy_beats, num_beats, _ = self.rhythm_ratios(track_audio, sr, threshold, heavy_threshold)
 
-        if num_strong_beats / float(len(beats)) >= success_percentage:
+        if num_strong_beats / float(num_beats) >= success_percentage:
             # if rhythmic, count number of heavy beats
-            if num_heavy_beats / float(len(beats)) >= heavy_percentage:
+            if num_heavy_beats / float(num_beats) >= heavy_percentage:
                 # (is_rhythmic, is_strong_rhythmic)
                 return (True,True)
             else:
@@ -55,47 +68,157 @@ class Automatic_Sorting():
         else:
             return (False,False)
 
-    def is_repetitive(self, track_name, sr, tau=0.3):
-
+    # fraction of beats with jump candidates, None if the track cannot be segmented;
+    # offset/ duration (secs) restrict it to one window of the track
+    def repetitive_ratio(self, track_name, offset=0.0, duration=None):
         try:
-            jukebox = R.InfiniteJukebox(filename=track_name, async=False)
+            jukebox = R.InfiniteJukebox(filename=track_name, async=False, offset=offset, duration=duration)
         except R.PopFormatError:
             print "Warning (Pop Estimation): This track could not be segmented properly due to formatting issues.  Genre will be recategorized."
-            return False
+            return None
 
         count = 0
         for i, b in enumerate(jukebox.beats):
             if b['jump_candidates'] != []:
                 count +=1 
 
-        if float(count) / len(jukebox.beats) >= tau:
+        return float(count) / len(jukebox.beats)
+
+    def is_repetitive(self, track_name, sr, tau=0.3):
+        ratio = self.repetitive_ratio(track_name)
+        if ratio is not None and ratio >= tau:
             return True
         else:
             return False
 
-    def categorize_audio(self, track_name, genre_label):
+    # evenly spaced excerpt offsets (secs), None if the track is too short to bother
+    def excerpt_offsets(self, duration, num_excerpts=3, excerpt_dur=20.0):
+        if duration <= 2 * num_excerpts * excerpt_dur:
+            return None
+
+        centres = [duration * (k + 1) / float(num_excerpts + 1) for k in range(num_excerpts)]
+        return [max(0.0, c - (excerpt_dur / 2.0)) for c in centres]
+
+    # (offset, duration) secs of one window in the middle of the track as long
+    # as the excerpts together, for the repetition check: repeats need a verse
+    # and chorus or so of context, which the short excerpts lack
+    def repetition_window(self, duration, num_excerpts=3, excerpt_dur=20.0):
+        length = num_excerpts * excerpt_dur
+        return max(0.0, (duration - length) / 2.0), length
+
+    # pool beat counts over a few short windows instead of the whole track
+    def excerpt_ratios(self, track_name, offsets, excerpt_dur=20.0):
+        num_strong_beats = 0
+        num_heavy_beats = 0
+        num_beats = 0
+        tempi = []
+
+        for offset in offsets:
+            excerpt, sr = audio_io.load(track_name, offset=offset, duration=excerpt_dur)
+            strong, heavy, n, tempo = self.rhythm_ratios(excerpt, sr)
+            num_strong_beats += strong
+            num_heavy_beats += heavy
+            num_beats += n
+            tempi.append(tempo)
+
+        return (num_strong_beats, num_heavy_beats, num_beats, float(np.median(tempi)))
+
+    # distance of the rhythm decision from its nearest threshold
+    def decision_margin(self, strong_ratio, heavy_ratio, success_percentage=0.5, heavy_percentage=0.25):
+        if strong_ratio < success_percentage:
+            return success_percentage - strong_ratio
+        else:
+            return min(strong_ratio - success_percentage, abs(heavy_ratio - heavy_percentage))
+
+    def categorize_audio(self, track_name, genre_label, fast=True, num_excerpts=3, excerpt_dur=20.0, fallback_margin=0.1, confidence_scale=0.25, success_percentage=0.5, heavy_percentage=0.25, tau=0.3):
         cat = self.genre_mapping(genre_label)
 
+        # path and margin are those of the step that made the final decision
+        # ('decided_by': label, rhythm or repetition)
+        report = {'track': track_name, 'bucket': cat, 'decided_by': 'label', 'path': 'label', 'margin': None, 'confidence': 1.0, 
+            'strong_ratio': None, 'heavy_ratio': None, 'tempo': None, 'repetitive_ratio': None, 'excerpts': None}
+        self.reports[track_name] = report
+
+        if cat != "":
+            return cat
+
         # assign a category ourselves 
         # NOTE: not indicative of genre, but type of modification to perform
-        if cat == "":
-            track_audio, sr = librosa.load(track_name)
-            has_rhythm, has_strong_rhythm = self.is_rhythmic(track_audio, sr)
-            if has_rhythm:
-                if has_strong_rhythm:
-                        return 'blues'
+        ratios = None
+        if fast:
+            duration = audio_io.duration(track_name)
+            offsets = self.excerpt_offsets(duration, num_excerpts, excerpt_dur)
+
+            if offsets is not None:
+                num_strong_beats, num_heavy_beats, num_beats, tempo = self.excerpt_ratios(track_name, offsets, excerpt_dur)
+                if num_beats > 0:
+                    ratios = (num_strong_beats / float(num_beats), num_heavy_beats / float(num_beats), tempo)
+                    margin = self.decision_margin(ratios[0], ratios[1], success_percentage, heavy_percentage)
+
+                    report['path'] = 'excerpt'
+                    report['excerpts'] = offsets
+
+                    # too close to call from excerpts alone
+                    if margin < fallback_margin:
+                        print "Excerpt decision within %.2f of threshold, analysing full track.." % margin
+                        ratios = None
+
+        if ratios is None:
+            track_audio, sr = audio_io.load(track_name)
+            num_strong_beats, num_heavy_beats, num_beats, tempo = self.rhythm_ratios(track_audio, sr)
+            ratios = (num_strong_beats / float(num_beats), num_heavy_beats / float(num_beats), tempo)
+            margin = self.decision_margin(ratios[0], ratios[1], success_percentage, heavy_percentage)
+            report['path'] = 'full'
+
+        strong_ratio, heavy_ratio, tempo = ratios
+        has_rhythm = strong_ratio >= success_percentage
+        has_strong_rhythm = has_rhythm and heavy_ratio >= heavy_percentage
+
+        report['strong_ratio'] = strong_ratio
+        report['heavy_ratio'] = heavy_ratio
+        report['tempo'] = float(tempo)
+        report['decided_by'] = 'rhythm'
+        report['margin'] = margin
+        report['confidence'] = min(1.0, margin / confidence_scale)
+
+        if has_rhythm:
+            if has_strong_rhythm:
+                cat = 'blues'
+            else:
+                # tighten this up with clustering
+                ratio = None
+                path = report['path']
+                if path == 'excerpt':
+                    ratio = self.repetitive_ratio(track_name, *self.repetition_window(duration, num_excerpts, excerpt_dur))
+
+                    # too close to call from the window alone
+                    if ratio is not None and abs(ratio - tau) < fallback_margin:
+                        print "Repetition within %.2f of threshold, analysing full track.." % abs(ratio - tau)
+                        ratio = None
+                if ratio is None:
+                    path = 'full'
+                    ratio = self.repetitive_ratio(track_name)
+
+                report['repetitive_ratio'] = ratio
+                # a track that can't be segmented stays with the rhythm decision
+                if ratio is not None:
+                    report['decided_by'] = 'repetition'
+                    report['path'] = path
+                    report['margin'] = abs(ratio - tau)
+                    report['confidence'] = min(1.0, report['margin'] / confidence_scale)
+                if report['repetitive_ratio'] is not None and report['repetitive_ratio'] >= tau:
+                    cat = 'pop'
                 else:
-                    if self.is_repetitive(track_name,sr):  # tighten this up with clustering
-                        return 'pop'
-                    else:
-                        return 'jazz'
+                    cat = 'jazz'
 
-                    # remove pop as a category for phase 2 of study
-                    # return 'jazz'
-            else:
-                return 'classical'
+                # remove pop as a category for phase 2 of study
+                # cat = 'jazz'
         else:
-            return cat
+            cat = 'classical'
+
+        report['bucket'] = cat
+        print "Classified %s as %s (%s, path: %s, confidence: %.2f)" % (track_name, cat, report['decided_by'], report['path'], report['confidence'])
+        return cat
 
     def is_int(self, time_sig):
         try:
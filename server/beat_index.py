@@ -0,0 +1,73 @@
+#####################################
+# Music Signaling Pipeline Prototype
+#   Beat Index: sorted beat, downbeat
+#   and segment positions of a track
+#
+# Author: Ishwarya Ananthabhotla
+######################################
+
+# Built once per track when it is loaded, in playback samples, and kept in
+# param_dict['index']. Every lookup is a binary search (np.searchsorted)
+# for the first position at or after a sample, so a modifier finds its
+# insertion point in O(log n) wherever it is in the song.
+#   beats:     param_dict['beats'], or the jukebox beat starts for pop
+#   downbeats: every time_sig-th beat, counting from the first
+#   segments:  starts of param_dict['bounds'] intervals
+
+import numpy as np
+
+
+class Beat_Index():
+    def __init__(self, beats=None, time_sig=4, segments=None):
+        self.beats = np.sort(np.asarray(beats if beats is not None else [], dtype=np.int64))
+        self.time_sig = max(1, int(time_sig))
+        self.downbeats = self.beats[::self.time_sig]
+        self.segments = np.sort(np.asarray(segments if segments is not None else [], dtype=np.int64))
+
+    # ordinal of the first beat at or after sample, len(beats) if there is none
+    def beat_at(self, sample):
+        return int(np.searchsorted(self.beats, sample))
+
+    # up to n beats from the first at or after sample (a view)
+    def next_beats(self, sample, n):
+        i = self.beat_at(sample)
+        return self.beats[i: i + n]
+
+    def is_downbeat(self, ordinal):
+        return ordinal % self.time_sig == 0
+
+    # first downbeat/ segment start at or after sample, None if there is none
+    def next_downbeat(self, sample):
+        return first_after(self.downbeats, sample)
+
+    def next_segment(self, sample):
+        return first_after(self.segments, sample)
+
+
+def first_after(positions, sample):
+    i = np.searchsorted(positions, sample)
+    if i == len(positions):
+        return None
+    return positions[i]
+
+# index of a param dict as loaded for playback
+def build(param_dict, time_sig=4):
+    if time_sig is None or str(time_sig).strip() == '':
+        time_sig = 4
+    if 'jukebox' in param_dict:
+        jukebox = param_dict['jukebox']
+        beats = [int(b['start'] * jukebox.sample_rate) for b in jukebox.beats]
+    else:
+        beats = param_dict.get('beats')
+
+    segments = None
+    if param_dict.get('bounds') is not None and len(param_dict['bounds']) > 0:
+        segments = np.asarray(param_dict['bounds'])[:, 0]
+    return Beat_Index(beats, int(time_sig), segments)
+
+# the index built at load time, or a fresh one for param dicts that never
+# went through the prefetcher
+def of(param_dict, time_sig=4):
+    if 'index' in param_dict:
+        return param_dict['index']
+    return build(param_dict, time_sig)
@@ -0,0 +1,52 @@
+#####################################
+# Music Signaling Pipeline Prototype
+#   Curves: classical tempo, delay and
+#   echo curves on one frame grid
+#
+# Author: Ishwarya Ananthabhotla
+######################################
+
+# Classical param dicts keep 'tempo', 'delay' and 'echo' (None unless
+# preprocessed with low_proc off) as float32 curves with one value every
+# param_dict['curve_hop'] source samples, starting at sample 0. value() reads
+# a curve at any source sample by linear interpolation, clamped at the ends.
+# Older artifacts kept tempo and delay per 512 sample onset frame and echo
+# per sample (or per 'echo_hop'), all float64; pack() moves them onto the grid.
+
+import numpy as np
+
+CURVE_HOP = 512
+
+CURVES = ['tempo', 'delay', 'echo']
+
+
+# curve with one value every hop_in samples, resampled to one every hop_out
+def regrid(curve, hop_in, hop_out):
+    curve = np.asarray(curve, dtype=np.float32)
+    if hop_in == hop_out:
+        return curve
+    n = max(1, int(np.ceil(len(curve) * hop_in / float(hop_out))))
+    return np.interp(np.arange(n) * (hop_out / float(hop_in)), np.arange(len(curve)), curve).astype(np.float32)
+
+# param_dict with its curves on the CURVE_HOP grid; dicts without a tempo
+# curve, or already packed, are returned as they are
+def pack(param_dict):
+    if 'tempo' not in param_dict or 'curve_hop' in param_dict:
+        return param_dict
+
+    frame_hop = param_dict.pop('frame_hop', CURVE_HOP)
+    hops = {'tempo': frame_hop, 'delay': frame_hop, 'echo': param_dict.pop('echo_hop', 1)}
+    for key in CURVES:
+        if param_dict.get(key) is not None:
+            param_dict[key] = regrid(param_dict[key], hops[key], CURVE_HOP)
+    param_dict['curve_hop'] = CURVE_HOP
+    return param_dict
+
+# curve key of param_dict at source sample
+def value(param_dict, key, sample):
+    curve = param_dict[key]
+    f = max(0.0, sample / float(param_dict.get('curve_hop', CURVE_HOP)))
+    i = min(int(f), len(curve) - 1)
+    j = min(i + 1, len(curve) - 1)
+    frac = min(f - i, 1.0)
+    return (1.0 - frac) * curve[i] + frac * curve[j]
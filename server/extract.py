@@ -7,6 +7,8 @@ import librosa
 import math 
 import numpy as np
 
+import parallel_dsp as pdsp
+
 ################################
 # UTILITIES
 ################################
@@ -203,8 +205,21 @@ def compute_energy_score(chroma_transpose, onset_lines, silent_segment_number, t
 # NOTE: weights and padding percentage are built in for now
 def extract_sample(sample_harmonic, sample_rate, num_pitches, window_size=15, n_fft=2048, hop_length=512, tfactor=0.6, multi_clip=False):
     # compute chroma and smooth
-    C_cqt = librosa.feature.chroma_stft(y=sample_harmonic, sr=sample_rate, n_fft=2048, hop_length=512)
-    
+    C_cqt = pdsp.chroma_stft(sample_harmonic, sr=sample_rate, n_fft=2048, hop_length=512)
+
+    sample_bounds, num_seg = select_samples(C_cqt, num_pitches, window_size, multi_clip)
+
+    rep_samples_audio = []
+    for samp_left, samp_right, pitch in sample_bounds:
+        rep_samples_audio.append((sample_harmonic[samp_left:samp_right], pitch))
+
+    #return (new_rep_sample, segment_pitch_list[idx])
+    return (rep_samples_audio, num_seg)
+
+# Pick the representative clip(s) from a chroma of the harmonic component;
+# returns ([(sample_left, sample_right, pitch)], num_seg) so callers that never
+# hold the full harmonic signal can fetch just the chosen region
+def select_samples(C_cqt, num_pitches, window_size=15, multi_clip=False):
     smooth_ct = temporal_smoothing(C_cqt, window_size)
 
 
@@ -281,7 +296,7 @@ def extract_sample(sample_harmonic, sample_rate, num_pitches, window_size=15, n_
             break
 
     # retrieve the clips and trim by 20%
-    rep_samples_audio = []
+    sample_bounds = []
 
     for s in output_samples:
         score, seg_idx = s
@@ -298,10 +313,8 @@ def extract_sample(sample_harmonic, sample_rate, num_pitches, window_size=15, n_
 
         new_samp_left = samp_left + (trim_length / 2)
         new_samp_right = samp_right - (trim_length / 2)    
-        new_rep_sample = sample_harmonic[new_samp_left:new_samp_right]
         
-        rep_samples_audio.append((new_rep_sample, segment_pitch_list[seg_idx]))        
+        sample_bounds.append((new_samp_left, new_samp_right, segment_pitch_list[seg_idx]))
 
-    #return (new_rep_sample, segment_pitch_list[idx])
-    return (rep_samples_audio, num_seg)
+    return (sample_bounds, num_seg)
 
@@ -7,11 +7,32 @@
 #########################################
 
 from collections import deque
+import threading
 
 def init():
 	global audio_buffer
+	global renderer
+	renderer = None
+	global latency
+	latency = None
+	global speculator
+	speculator = None
+	global pop_signal
+	pop_signal = None
+	# song the pop signal is for, its scheduler entry (entry, song) until it
+	# lands, and the lock the jukebox source takes to read or clear them
+	global pop_song
+	pop_song = None
+	global pop_entry
+	pop_entry = None
+	global pop_lock
+	pop_lock = threading.Lock()
 	global sr
 	sr = 22050
+	global channels
+	channels = 1
+	global output_latency
+	output_latency = 0.0
 	global ptr
 	ptr = 0L
 	global song_index
@@ -19,6 +40,7 @@ def init():
 	global pop_alert
 	pop_alert = False
 	global pop_subtlety
+	pop_subtlety = -1
 	global msg_q
 	msg_q = deque()
 	global new_song
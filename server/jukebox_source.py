@@ -0,0 +1,157 @@
+#####################################
+# Music Signaling Pipeline Prototype
+#   Jukebox Source: the pop remix as
+#   a stream of beats for the renderer
+#
+# Author: Ishwarya Ananthabhotla
+######################################
+
+# The renderer pulls a pop track one beat at a time through next_run() (see
+# render.py), so each jump is decided just before that beat is rendered:
+# no thread, no sleeping, no guessing how far ahead of gs.ptr to stay.
+# Until a signal sets gs.pop_subtlety (for this song, gs.pop_song) the beats
+# simply follow one another, which plays the track as it is. After a signal:
+#   level 2:    the alert plays in place of the next beat
+#   level 0/1:  jump to a candidate beat at the next jump beat (downbeats
+#               for level 0, any other beat for level 1, or whenever too
+#               many beats have gone by without a jump); level 0 avoids
+#               recently played segments
+# A jump to one of a beat's top candidates plays the crossfade stored at
+# preprocessing (param_dict['transitions']) and then the rest of the beat;
+# candidates without one get a trapezoid taper instead. When a beat has
+# candidates with crossfades, the jump is chosen among those.
+# Runs are (audio, source position of the beat it stands for), so gs.ptr
+# follows the original track through the remix.
+
+import collections
+
+import numpy as np
+
+import global_settings as gs
+import audio_io
+import beat_index
+import windows
+
+
+class Jukebox_Source():
+    def __init__(self, audio, param_dict, song):
+        self.audio = audio
+        self.param_dict = param_dict
+        self.song = song
+        self.jukebox = param_dict['jukebox']
+        self.index = beat_index.of(param_dict)
+
+        # min beats before we have to jump, 10% of beats in the song
+        self.max_beats_between_jumps = int(round(len(self.jukebox.beats) * .1))
+        self.beats_since_last_jump = 0
+
+        recent_seg_depth = max(int(round(self.jukebox.segments * .25)), 1)
+        self.recent_segments = collections.deque(maxlen=recent_seg_depth)
+
+        # the beat last handed out, None before the first
+        self.beat = None
+        self.jumps = 0
+
+        # rest of a beat after its crossfade, handed out next
+        self.pending = None
+        self.transitions = param_dict.get('transitions', {'length': 0, 'heads': {}})
+
+    def position(self, beat):
+        return long(beat['start'] * self.jukebox.sample_rate)
+
+    # (audio, source position) of the next run, None at the end of the track
+    def next_run(self):
+        if self.pending is not None:
+            run, self.pending = self.pending, None
+            return run
+
+        if self.beat is None:
+            self.beat = self.jukebox.beats[0]
+            first = self.position(self.beat)
+            if first > 0:
+                # whatever comes before the first beat, as a beat of the first
+                # beat's segment that leads into it and can't be jumped from
+                self.beat = {'id': -1, 'next': 0, 'start': 0.0, 'buffer': self.audio[:first],
+                    'segment': self.beat['segment'], 'jump_candidates': []}
+                return self.beat['buffer'], 0L
+            return self.beat['buffer'], first
+
+        curr_beat = self.beat
+        # a signal meant for another song is not ours to play
+        with gs.pop_lock:
+            level = gs.pop_subtlety if gs.pop_song == self.song else -1
+        if level == 0:
+            # only jump on down beat for level 0
+            is_jump_beat = self.index.is_downbeat(curr_beat['id']) or (self.beats_since_last_jump >= self.max_beats_between_jumps)
+        else:
+            # jump on any other beat for level 1 and level 2
+            is_jump_beat = (not self.index.is_downbeat(curr_beat['id'])) or (self.beats_since_last_jump >= self.max_beats_between_jumps)
+
+        if level == 2 and curr_beat['next'] is not None:
+            self.beat = self.jukebox.beats[curr_beat['next']]
+            run = self.alert(self.beat), self.position(self.beat)
+            self.landed(run[1])
+            self.beats_since_last_jump += 1
+
+        elif (level == 0 or level == 1) and curr_beat['jump_candidates'] != [] and is_jump_beat:
+            if level == 0:
+                filtered_candidates = [c for c in curr_beat['jump_candidates'] if self.jukebox.beats[c]['segment'] not in self.recent_segments]
+                if filtered_candidates == []: # if we can't maintain this rule, relax it
+                    filtered_candidates = curr_beat['jump_candidates']
+            else:
+                filtered_candidates = curr_beat['jump_candidates']
+
+            heads = self.transitions['heads']
+            smooth = [c for c in filtered_candidates if (curr_beat['id'], c) in heads]
+            if smooth != []:
+                filtered_candidates = smooth
+
+            # make the jump
+            jump_beat_index = np.random.choice(filtered_candidates)
+            self.beat = self.jukebox.beats[jump_beat_index]
+            run = self.jump(curr_beat, self.beat), self.position(self.beat)
+            self.landed(run[1])
+            self.beats_since_last_jump = 0
+
+        elif curr_beat['next'] is None:
+            return None
+
+        else:
+            self.beat = self.jukebox.beats[curr_beat['next']]
+            run = self.beat['buffer'], self.position(self.beat)
+            self.beats_since_last_jump += 1
+
+        if self.beat['segment'] not in self.recent_segments:
+            self.recent_segments.append(self.beat['segment'])
+        return run
+
+    # the signal is dealt with once its beat is rendered
+    def landed(self, position):
+        print "JUMPING AT --> JUKEBOX PTR: ", position
+        with gs.pop_lock:
+            gs.latency.landed(gs.pop_signal, self.song, position)
+            gs.pop_signal = None
+            gs.pop_subtlety = -1
+        self.jumps += 1
+
+    # alert in place of beat, a whole number of beats long (at least a second)
+    def alert(self, beat):
+        beat_size = len(beat['buffer'])
+        if beat_size < gs.sr:
+            alert_length = int(np.floor(gs.sr / beat_size)) * beat_size
+        else:
+            alert_length = beat_size
+        return self.param_dict['alert'][:alert_length]
+
+    # first run of the beat jumped to from curr_beat: the stored crossfade
+    # (the rest of the beat is left pending), or else the beat with a weak
+    # trapezoidal taper
+    def jump(self, curr_beat, beat):
+        head = self.transitions['heads'].get((curr_beat['id'], beat['id']))
+        if head is not None:
+            n = len(head)
+            self.pending = (beat['buffer'][n:], self.position(beat) + n)
+            return head
+
+        buf = audio_io.to_float32(beat['buffer'])
+        return windows.apply(buf, windows.trapezoid(len(buf)), out=buf)
@@ -0,0 +1,127 @@
+#####################################
+# Music Signaling Pipeline Prototype
+#   Latency: follow each signal from
+#   the socket to the speaker
+#
+# Author: Ishwarya Ananthabhotla
+######################################
+
+# Every signal gets a record when it is received. Each stage it passes adds a
+# wall-clock time and the playback clock (samples handed to the sink so far):
+#   'received':  read off the socket (or fired by a script)
+#   'dequeued':  handed to a modifier by the scheduler (scheduler.py)
+#   'mod_start', 'mod_end': the modifier call
+#   'landed':    edit accepted by the renderer, at (song, sample) 'position'
+#   'heard':     gs.ptr passed 'position', plus the sink's output latency
+# Offline sinks run faster than realtime, so latency there is measured on the
+# playback clock instead of the wall clock.
+
+import threading
+import time
+
+import numpy as np
+
+STAGES = ['received', 'dequeued', 'mod_start', 'mod_end', 'landed', 'heard']
+
+# 'merged': folded into an earlier signal of the same burst; 'expired': waited
+# in the scheduler longer than its max_age_secs; 'song_changed': landed, but
+# playback moved on to a later song before reaching it. Edits refused as late
+# are retried by the scheduler, not dropped
+DROP_REASONS = ['merged', 'expired', 'song_changed']
+
+
+class Latency_Tracker():
+    def __init__(self, sr=22050, realtime=True, output_latency=0.0):
+        self.sr = sr
+        self.realtime = realtime
+        self.output_latency = output_latency
+        self.signals = []
+        # landed but not yet heard; appended by modifier threads, cleared by the audio thread
+        self.waiting = []
+        self.drops = dict((r, 0) for r in DROP_REASONS)
+        self.frames = 0L
+        self.lock = threading.Lock()
+
+    def received(self, level=None, frames=None):
+        sig = {'level': level, 'genre': None, 'position': None, 'dropped': None, 'times': {}, 'frames': {}}
+        with self.lock:
+            self.signals.append(sig)
+        self.mark(sig, 'received', frames)
+        return sig
+
+    def mark(self, sig, stage, frames=None):
+        if sig is None:
+            return
+        sig['times'][stage] = time.time()
+        sig['frames'][stage] = self.frames if frames is None else frames
+
+    def landed(self, sig, song, position):
+        if sig is None:
+            return
+        self.mark(sig, 'landed')
+        sig['position'] = (song, position)
+        self.waiting.append(sig)
+
+    def dropped(self, sig, reason):
+        with self.lock:
+            self.drops[reason] += 1
+        if sig is not None:
+            sig['dropped'] = reason
+
+    # called from the audio thread with what it has just handed to the sink
+    # (self.frames is kept up to date by the same thread). Signals landed in a
+    # song that has not started playing yet keep waiting for it
+    def played(self, song, ptr):
+        for sig in list(self.waiting):
+            landed_song, position = sig['position']
+            if song is None or landed_song > song or (landed_song == song and ptr < position):
+                continue
+            if landed_song == song:
+                sig['times']['heard'] = time.time() + self.output_latency
+                sig['frames']['heard'] = self.frames + long(self.output_latency * self.sr)
+            else:
+                self.dropped(sig, 'song_changed')
+            self.waiting.remove(sig)
+
+    ###################################
+    # SUMMARIES
+    ###################################
+
+    # secs between two stages of one signal, None if it never got that far
+    def between(self, sig, first='received', last='heard'):
+        if first not in sig['times'] or last not in sig['times']:
+            return None
+        if self.realtime:
+            return sig['times'][last] - sig['times'][first]
+        return (sig['frames'][last] - sig['frames'][first]) / float(self.sr)
+
+    # (genre, level) -> list of end to end latencies (secs)
+    def latencies(self, first='received', last='heard'):
+        out = {}
+        for sig in self.signals:
+            secs = self.between(sig, first, last)
+            if secs is not None:
+                out.setdefault((sig['genre'], sig['level']), []).append(secs)
+        return out
+
+    # (genre, level) -> (counts, bin edges) of end to end latency
+    def histograms(self, bin_secs=0.25, max_secs=10.0):
+        edges = np.arange(0.0, max_secs + bin_secs, bin_secs)
+        return dict((key, np.histogram(np.clip(v, 0.0, max_secs), bins=edges)) for key, v in self.latencies().items())
+
+    def report(self, bin_secs=0.25):
+        print "Signals: %d received, dropped %s" % (len(self.signals), ", ".join("%s %d" % (r, self.drops[r]) for r in DROP_REASONS))
+
+        histograms = self.histograms(bin_secs)
+        for (genre, level), v in sorted(self.latencies().items()):
+            print "%s level %s: %d heard, median %.2fs, 90%% %.2fs, max %.2fs" % (genre, level, len(v), np.median(v), np.percentile(v, 90), np.max(v))
+            counts, edges = histograms[(genre, level)]
+            for count, edge in zip(counts, edges):
+                if count > 0:
+                    print "  %5.2fs %s" % (edge, '#' * count)
+
+        # where the time goes, stage by stage
+        for first, last in zip(STAGES[:-1], STAGES[1:]):
+            v = [s for s in [self.between(sig, first, last) for sig in self.signals] if s is not None]
+            if v != []:
+                print "  %s -> %s: median %.3fs" % (first, last, np.median(v))
@@ -0,0 +1,207 @@
+############################################
+# Music Signaling Pipeline Prototype
+#   library_index: persistent per-track
+#       analysis summary for building and
+#       checking playlists without
+#       re-running analysis
+#
+# Author: Ishwarya Ananthabhotla
+############################################
+
+import os
+import csv
+import time
+
+import numpy as np
+
+import automatic_sort as AS
+import audio_io
+
+# column name -> numpy dtype; one row per file in tracks/
+COLUMNS = [('name', str), ('duration', np.float32), ('bucket', str), ('tempo', np.float32), ('meter', np.int8),
+    ('strong_ratio', np.float32), ('heavy_ratio', np.float32), ('repetitive_ratio', np.float32),
+    ('artifact', str), ('artifact_bytes', np.int64), ('analysed_at', np.float64)]
+
+AUDIO_EXTENSIONS = ['.mp3', '.wav', '.flac', '.ogg', '.aif', '.aiff', '.m4a']
+
+
+# best-effort tempo (bpm) from whatever the genre's param dict keeps
+def estimate_tempo(param_dict, sr=22050):
+    if 'jukebox' in param_dict:
+        return float(param_dict['jukebox'].tempo)
+    if 'beats' in param_dict and len(param_dict['beats']) > 1:
+        return 60.0 / (np.median(np.diff(param_dict['beats'])) / float(sr))
+    if 'tempo' in param_dict and param_dict['tempo'] is not None:
+        # normalized_tempo maps 0-240 bpm onto 0-1
+        return float(np.median(param_dict['tempo'])) * 240.0
+    return np.nan
+
+
+def repetitive_ratio(param_dict):
+    if 'jukebox' not in param_dict:
+        return np.nan
+    beats = param_dict['jukebox'].beats
+    return sum(1 for b in beats if b['jump_candidates'] != []) / float(len(beats))
+
+
+def file_duration(track_path):
+    try:
+        return audio_io.duration(track_path)
+    except Exception:
+        return np.nan
+
+
+class Library_Index():
+    def __init__(self, path='preprocess_data/library_index.npz'):
+        self.path = path
+        self.rows = {}
+        self.load()
+
+    def empty_row(self, name):
+        return {'name': name, 'duration': np.nan, 'bucket': '', 'tempo': np.nan, 'meter': 0,
+            'strong_ratio': np.nan, 'heavy_ratio': np.nan, 'repetitive_ratio': np.nan,
+            'artifact': '', 'artifact_bytes': 0, 'analysed_at': 0.0}
+
+    def load(self):
+        self.rows = {}
+        if not os.path.exists(self.path):
+            return
+
+        data = np.load(self.path)
+        columns = dict((c, data[c].tolist()) for c, _ in COLUMNS if c in data.files)
+        data.close()
+
+        for i, name in enumerate(columns['name']):
+            row = self.empty_row(name)
+            for c in columns:
+                row[c] = columns[c][i]
+            self.rows[name] = row
+
+    def save(self):
+        names = sorted(self.rows.keys())
+        columns = {}
+        for c, dtype in COLUMNS:
+            columns[c] = np.array([self.rows[n][c] for n in names], dtype=dtype)
+
+        # write next to the index and swap in, so a crash never leaves half a file
+        tmp_path = self.path + '.tmp.npz'
+        np.savez_compressed(tmp_path, **columns)
+        os.rename(tmp_path, self.path)
+
+    # add/ drop rows so the index covers exactly the files in the track folder
+    def refresh(self, source_file_path='tracks/'):
+        on_disk = [f for f in os.listdir(source_file_path) if os.path.splitext(f)[1].lower() in AUDIO_EXTENSIONS]
+
+        for name in on_disk:
+            if name not in self.rows:
+                self.rows[name] = self.empty_row(name)
+            if np.isnan(self.rows[name]['duration']):
+                self.rows[name]['duration'] = file_duration(source_file_path + name)
+
+        for name in self.rows.keys():
+            if name not in on_disk:
+                del self.rows[name]
+
+        self.save()
+
+    # record one track's analysis results and persist straight away
+    def update(self, name, genre_tag, time_sig, param_dict, artifact, report=None, source_file_path='tracks/'):
+        row = self.rows.get(name, self.empty_row(name))
+
+        if np.isnan(row['duration']):
+            row['duration'] = file_duration(source_file_path + name)
+        row['bucket'] = genre_tag
+        row['meter'] = int(time_sig)
+        row['artifact'] = artifact
+        row['artifact_bytes'] = os.path.getsize(artifact) if os.path.exists(artifact) else 0
+        row['analysed_at'] = time.time()
+        row['repetitive_ratio'] = repetitive_ratio(param_dict)
+        row['tempo'] = estimate_tempo(param_dict)
+
+        if report is not None:
+            if report['strong_ratio'] is not None:
+                row['strong_ratio'] = report['strong_ratio']
+                row['heavy_ratio'] = report['heavy_ratio']
+            if report['tempo'] is not None:
+                row['tempo'] = report['tempo']
+            if report['repetitive_ratio'] is not None:
+                row['repetitive_ratio'] = report['repetitive_ratio']
+
+        self.rows[name] = row
+        self.save()
+
+    def query(self, bucket=None, meter=None, analysed=True, min_tempo=None, max_tempo=None):
+        out = []
+        for name in sorted(self.rows.keys()):
+            row = self.rows[name]
+            if bucket is not None and row['bucket'] != bucket:
+                continue
+            if meter is not None and row['meter'] != int(meter):
+                continue
+            if analysed and (row['artifact'] == '' or not os.path.exists(row['artifact'])):
+                continue
+            if min_tempo is not None and not row['tempo'] >= min_tempo:
+                continue
+            if max_tempo is not None and not row['tempo'] <= max_tempo:
+                continue
+            out.append(row)
+        return out
+
+    # fill up to total_secs of audio from matching rows
+    def playlist(self, total_secs, shuffle=False, **criteria):
+        rows = self.query(**criteria)
+        if shuffle:
+            np.random.shuffle(rows)
+
+        selected = []
+        elapsed = 0.0
+        for row in rows:
+            if elapsed >= total_secs:
+                break
+            if np.isnan(row['duration']):
+                continue
+            selected.append(row)
+            elapsed += row['duration']
+
+        return selected
+
+    def write_playlist(self, rows, list_file='info.csv'):
+        ofile = open(list_file, 'wb')
+        writer = csv.writer(ofile)
+        for row in rows:
+            writer.writerow([row['name'], row['bucket'], row['meter']])
+        ofile.close()
+
+    # list of (track, problem) for rows of an info.csv that would need fresh analysis
+    def validate_playlist(self, list_file='info.csv', source_file_path='tracks/'):
+        problems = []
+        a = AS.Automatic_Sorting()
+        ifile = open(list_file, 'rb')
+        for row in csv.reader(ifile):
+            if len(row) == 0:
+                continue
+            name = row[0]
+            if not os.path.exists(source_file_path + name):
+                problems.append((name, 'missing from ' + source_file_path))
+            elif name not in self.rows or self.rows[name]['artifact'] == '':
+                problems.append((name, 'not analysed'))
+            elif not os.path.exists(self.rows[name]['artifact']):
+                problems.append((name, 'artifact missing'))
+            elif len(row) > 1 and row[1] != '' and a.genre_mapping(row[1]) != self.rows[name]['bucket']:
+                problems.append((name, 'analysed as ' + self.rows[name]['bucket'] + ', listed as ' + row[1]))
+            elif len(row) > 2 and row[2] != '' and not a.is_int(row[2]):
+                problems.append((name, 'invalid meter ' + row[2]))
+            elif len(row) > 2 and row[2] != '' and int(row[2]) != self.rows[name]['meter']:
+                problems.append((name, 'analysed in ' + str(self.rows[name]['meter']) + ', listed in ' + row[2]))
+        ifile.close()
+        return problems
+
+    def total_duration(self, rows):
+        return sum(r['duration'] for r in rows if not np.isnan(r['duration']))
+
+
+if __name__ == '__main__':
+    index = Library_Index()
+    index.refresh()
+    for row in index.query(analysed=False):
+        print row['name'], row['bucket'], row['duration'], row['tempo'], row['artifact_bytes']
@@ -0,0 +1,56 @@
+#####################################
+# Music Signaling Pipeline Prototype
+#   Loudness: in-memory level matching
+#   and limiting for modifier clips
+#
+# Author: Ishwarya Ananthabhotla
+######################################
+
+# Levels are dBFS of the RMS, as pydub's AudioSegment.dBFS reports them for
+# 16 bit audio (full scale 1.0 here), so matched clips sound the same as
+# before without the WAV round trip.
+
+import numpy as np
+
+
+def rms(y):
+    if len(y) == 0:
+        return 0.0
+    return np.sqrt(np.mean(np.square(y, dtype=np.float64)))
+
+# -inf for digital silence
+def dbfs(y):
+    level = rms(y)
+    if level == 0.0:
+        return -np.inf
+    return 20.0 * np.log10(level)
+
+def db_to_gain(db):
+    return 10.0 ** (db / 20.0)
+
+# y scaled to target_dbfs; silence (either side) is left as is
+def match_dbfs(y, target_dbfs):
+    current = dbfs(y)
+    if np.isinf(current) or np.isinf(target_dbfs):
+        return y
+    return (y * db_to_gain(target_dbfs - current)).astype(np.float32)
+
+# y scaled to the level of reference
+def match_loudness(y, reference):
+    return match_dbfs(y, dbfs(reference))
+
+# linear up to threshold, then a tanh knee that never passes full scale
+def soft_limit(y, threshold=0.9, out=None):
+    if out is None:
+        out = np.array(y, dtype=np.float32)
+    elif out is not y:
+        out[:] = y
+
+    over = np.abs(out) > threshold
+    if not over.any():
+        return out
+
+    headroom = 1.0 - threshold
+    peaks = out[over]
+    out[over] = np.sign(peaks) * (threshold + headroom * np.tanh((np.abs(peaks) - threshold) / headroom))
+    return out
@@ -6,7 +6,6 @@
 # Author: Ishwarya Ananthabhotla
 #########################################
 
-import pyaudio
 import pygame
 import wave
 import sys
@@ -26,280 +25,238 @@ import global_settings as gs
 import pre_processing as pre
 import modify_buffer as mb
 import automatic_sort as AS
-
-# THREAD 1: Write audio from buffer to stream in chunks
-def stream_audio(track_names, genre_tags, param_dict_list, modify_flag, end_stream, connection):
-    # instantiate PyAudio 
-    p = pyaudio.PyAudio()
-
-    # open stream 
-    stream = p.open(format=pyaudio.paFloat32,
-                    channels=1,
-                    rate=gs.sr,
-                    output=True)
-
-    hop_size_bytes = 1024 * 4 # bytes
+import library_index as LI
+import audio_io
+import prefetch
+import render
+import sinks
+import latency
+import speculate
+import vocoder
+import curves
+import beat_index
+import jukebox_source
+import scheduler
+
+# THREAD 1: Hand tracks to the renderer one after another and play what it renders
+def stream_audio(track_names, genre_tags, param_dict_list, modify_flag, end_stream, connection, prefetcher, sink, block_size=1024, ahead_secs=0.5):
+    song_done = threading.Event()
+    gs.audio_buffer = np.zeros(0, dtype=np.float32)
+    gs.renderer = render.Renderer(gs.sr, block_size, ahead_secs, gs.channels)
+    gs.latency.sr = gs.sr
+
+    out_block = np.zeros(block_size if gs.channels == 1 else (block_size, gs.channels), dtype=np.float32)
+
+    # runs on the sink's thread (the PortAudio thread for the sound card): no
+    # allocation of sample data and no printing. gs.ptr, gs.song_index and
+    # gs.audio_buffer follow what the sink is given, not what the renderer has got to
+    def pull(frame_count):
+        out = out_block[:frame_count]
+        if not sink.realtime:
+            # no render thread offline: render on demand, waiting out track loads
+            while not gs.renderer.fill(frame_count):
+                time.sleep(0.005)
+        n = gs.renderer.read(out)
+        out[n:] = 0.0
+
+        playing = gs.renderer.now_playing()
+        if playing is not None:
+            song, source, gs.ptr = playing
+            if song != gs.song_index:
+                gs.audio_buffer = source
+                gs.song_index = song
+
+        gs.latency.frames = gs.renderer.ring.read_pos
+        if gs.latency.waiting:
+            gs.latency.played(gs.song_index, gs.ptr)
+
+        if n < frame_count and gs.renderer.exhausted:
+            song_done.set()
+            return out, False
+
+        return out, True
+
+    sink.open(gs.sr, block_size, pull, gs.channels)
+    gs.output_latency = sink.latency()
+    gs.latency.realtime = sink.realtime
+    gs.latency.output_latency = gs.output_latency
+    if sink.realtime:
+        gs.renderer.start()
 
     for i, track in enumerate(track_names):
-        gs.audio_buffer, gs.sr = librosa.load(track)
-        gs.audio_buffer, _ = librosa.effects.trim(gs.audio_buffer)
-        gs.song_index = i
+        # normally already loaded while the previous song played
+        loaded = prefetcher.get(i)
+        if loaded is None:
+            continue
+        audio, param_dict_list[i] = loaded
+
+        # pop tracks play as a stream of beats the jukebox can jump around in
+        if genre_tags[i] == 'pop':
+            audio = jukebox_source.Jukebox_Source(audio, param_dict_list[i], i)
+
+        # the renderer runs straight on into it when the current one ends
+        gs.renderer.queue(audio, i)
+        while gs.song_index != i and not end_stream.is_set():
+            time.sleep(0.01)
+        if end_stream.is_set():
+            break
 
-        gs.ptr = 0L
+        # load the following track in the background while this one plays
+        prefetcher.prefetch(i + 1)
 
-        # continue modifier thread
+        # tell the modifier thread this is a fresh song
+        gs.new_song = True
         modify_flag.set()
         print "New song loaded!"        
 
-        # termination signal from other thread
-        while gs.ptr < len(gs.audio_buffer) and not end_stream.is_set():
-
-            # convert to string
-            out_data = gs.audio_buffer[gs.ptr: gs.ptr + (hop_size_bytes * 16)]
-            out_data = out_data.astype(np.float32).tostring()
-
-            # write to stream
-            stream.write(out_data)
-            gs.ptr += (hop_size_bytes * 16)
+    # termination signal from other thread, or the last song running out
+    gs.renderer.finish()
+    while not song_done.is_set() and not end_stream.is_set():
+        song_done.wait(0.25)
+    print "Cleaning up and closing.."
 
-            print "ptr: ", gs.ptr
-
-        if not end_stream.is_set() and i != len(track_names)-1:
-            # make modifier thread wait while we load new song
-            modify_flag.clear()
-            gs.new_song = True
-            print "Loading new song.."
-            # time.sleep(1) # wait for buffer thread to reset
-        else:
-            print "Cleaning up and closing.."
-            break
-
-            
     # stop stream
-    stream.stop_stream()
-    stream.close()
-
-    p.terminate()
+    sink.close()
+    gs.renderer.stop()
+    if gs.speculator is not None:
+        gs.speculator.stop()
+
+    audio_io.report()
+    if gs.renderer.underruns > 0 or gs.renderer.late_edits > 0:
+        print "Render underruns: %d, late edits: %d" % (gs.renderer.underruns, gs.renderer.late_edits)
+    gs.latency.report()
+    if gs.speculator is not None:
+        gs.speculator.report()
 
     # termination signal from this thread
-    gs.msg_q.append('end:0')
+    gs.msg_q.append(('end:0', None))
     print "Thank you for listening!"
     return
 
 
 # THREAD 2: Monitor socket for flags and call modifiers
-def modify_buffer(param_dict, current_genre, current_timesig, level, new_song, dur=4, buff_time=2, pop_buff_time=3, msg_length=5):
-    # modification settings
-    hop_size_bytes = 1024 * 4 # bytes
-    done_flag = False
-    count = 0
-    start_jukebox = False
-    msg = ''
-
-    
-    if current_genre == 'pop':
-        start = gs.ptr + (pop_buff_time * (hop_size_bytes * 16))
-    else:
-        start = gs.ptr + (buff_time * (hop_size_bytes * 16))                
+
+# running estimate of each modifier's wall time (secs) by (genre, level),
+# seeded with rough figures for a laptop
+DEFAULT_PROCESSING_SECS = {'jazz': 1.0, 'classical': 1.0, 'blues': 0.2, 'pop': 0.25}
+processing_secs = {}
+
+def processing_estimate(genre, level):
+    return processing_secs.get((genre, level), DEFAULT_PROCESSING_SECS.get(genre, 1.0))
+
+# exponential moving average, alpha weights the newest run
+def record_processing(genre, level, secs, alpha=0.3):
+    processing_secs[(genre, level)] = (1.0 - alpha) * processing_estimate(genre, level) + alpha * secs
+
+# 'placed', 'no_audio' if there was not enough of the song left to place the
+# modification, or 'late' if the renderer had already passed it
+def modify_buffer(param_dict, current_genre, current_timesig, level, new_song, sig=None, dur=4, safety=1.5, margin=0.1):
+    if sig is not None:
+        sig['genre'] = current_genre
+        sig['level'] = level
+    gs.latency.mark(sig, 'mod_start')
+
+    editable = gs.renderer.editable_from(gs.song_index)
+    if editable is None:
+        print "Not enough audio left to modify. Sleeping.."
+        return 'no_audio'
+
+    # edits must start past whatever is rendered by the time the modifier is
+    # done: the renderer's editable point plus the modifier's expected DSP time
+    processing = int((safety * processing_estimate(current_genre, level) + margin) * gs.sr)
+    start = editable + processing
 
     if start + (dur * gs.sr) >= len(gs.audio_buffer):
         print "Not enough audio left to modify. Sleeping.."
-        return
+        return 'no_audio'
+
+    # the edit plays once the device has had everything before the editable
+    # point (gs.ptr stands still through a splice, so it can't tell us that);
+    # samples handed to the sink now are heard output_latency later
+    lead = gs.renderer.ahead_of_editable() + processing
+    print "Modification lands in %.2fs.." % (lead / float(gs.sr) + gs.output_latency)
+    start_time = time.time()
+    hits = mb.ready_hits
+
+    # sample the edit landed at, None if the renderer refused it
+    song = gs.song_index
+    landed = None
 
     if current_genre == 'jazz':
         print "Modification Signaled.."
-        done_flag = mb.modify_jazz(level, param_dict, start)
+        landed = mb.modify_jazz(level, param_dict, start)
     elif current_genre == 'classical':
         print "Modification Signaled.."
-        done_flag = mb.modify_classical(level, param_dict, start)
+        landed = mb.modify_classical(level, param_dict, start)
     elif current_genre == 'blues':
         print "Modification Signaled.."
-        done_flag = mb.modify_blues(level, param_dict, start, current_timesig)
+        landed = mb.modify_blues(level, param_dict, start, current_timesig)
     elif current_genre == 'pop':
-        if new_song:
-            t3 = threading.Thread(target=start_jukebox_process, args=(param_dict, start, current_timesig, ))
-            t3.daemon = True          
-            t3.start()
-
-        done_flag = mb.modify_pop(level, param_dict, start)
+        # lands when the jukebox source makes the jump; while one signal waits
+        # for its jump, another raises its level instead of replacing it
+        with gs.pop_lock:
+            waiting = gs.pop_subtlety != -1 and gs.pop_song == song
+            if waiting:
+                gs.pop_subtlety = max(gs.pop_subtlety, level)
+            else:
+                gs.pop_signal = sig
+                gs.pop_song = song
+                mb.modify_pop(level)
+        if waiting:
+            gs.latency.dropped(sig, 'merged')
+            return 'merged'
 
     else:
         raise NotImplementedError 
 
-
-    return
-
-def start_jukebox_process(param_dict, start, current_timesig):
-
-    ######################################################
-    # weak trapezoidal taper window for each beat
-    def beat_window(sig, high_end=1.0, low_end=0.5):
-        fade_samples = int(len(sig) * (1.0 / 8.0))
-
-        # ramp up
-        ramp_up = np.array([(-1.0 * (low_end - high_end) / fade_samples) * x + low_end for x in range(fade_samples)])
-        sig[:fade_samples] *= ramp_up
-
-        #ramp down
-        ramp_down = np.array([(-1.0 * (high_end - low_end) / fade_samples) * x + high_end for x in range(fade_samples)])
-        sig[-fade_samples:] *= ramp_down
-
-        return sig
-
-
-    def taper_buffer_edges(range_start, range_end, fade_time, high_end=1.0, low_end=0.5):
-        fade_samples = int(fade_time * gs.sr)
-        # ramp down
-        ramp_down = np.array([(-1.0 * (high_end - low_end) / fade_samples) * x + high_end for x in range(fade_samples)])
-        gs.audio_buffer[range_start - fade_samples: range_start] *= ramp_down 
-
-        #ramp up 
-        ramp_up = np.array([(-1.0 * (low_end - high_end) / fade_samples) * x + low_end for x in range(fade_samples)])
-        gs.audio_buffer[range_end: range_end + fade_samples] *= ramp_up
-
-        return 
-    #######################################################
-
-    print "Starting Jukebox thread.."
-
-
-    jukebox = param_dict['jukebox']
-    beat_multiple = int(current_timesig)
-
-    # compute list of beat samples
-    beat_samples = np.array([b['start']*jukebox.sample_rate for b in jukebox.beats], dtype=int)
-
-    # get ordinal beat closest to start, set jkbx ptr to its sample
-    nearest_beat_index = np.argwhere(beat_samples >= start)[0][0]
-    curr_beat = jukebox.beats[nearest_beat_index]
-    beat_buf = curr_beat['buffer']
-    jkbx_ptr = 0L  
-
-    jkbx_ptr = long(curr_beat['start'] * gs.sr)
-
-    # GUT
-    gs.audio_buffer[jkbx_ptr:] = 0
-
-    # settings that force a jump
-    # previous_alert = None
-
-    # min beats before we have to jump, 10% of beats in the song
-    max_beats_between_jumps = int(round(len(jukebox.beats) * .1))
-
-    beats_since_last_jump = 0
-
-    recent_seg_depth = int(round(jukebox.segments * .25))
-    recent_seg_depth = max( recent_seg_depth, 1 )
-    recent_segments = collections.deque(maxlen=recent_seg_depth)
-
-    sleep_time = 0.35
-
-    while jkbx_ptr < len(gs.audio_buffer):
-        # insert current beat
-        if jkbx_ptr + len(beat_buf) > len(gs.audio_buffer):
-            # fill balance with silence
-            gs.audio_buffer[-1 * (len(gs.audio_buffer) - jkbx_ptr): ] = 0
-            # gs.audio_buffer = np.concatenate((gs.audio_buffer, np.zeros(jkbx_ptr + len(beat_buf) - len(gs.audio_buffer))))
-            print "Finished Jukebox thread.."
+    # ready-made clips take next to no time; counting them would shorten the
+    # lead the next live render gets
+    if mb.ready_hits == hits:
+        record_processing(current_genre, level, time.time() - start_time)
+    gs.latency.mark(sig, 'mod_end')
+    if current_genre != 'pop':
+        if landed is None:
+            return 'late'
+        gs.latency.landed(sig, song, landed)
+    return 'placed'
+
+# run a signal from the scheduler on the current song. One the renderer
+# refused as late goes again from a fresh editable point; one the song has
+# no room left for waits for the next song
+def dispatch(signals, entry, param_dict_list, genre_tags, time_sigs):
+    song = gs.song_index
+    gs.latency.mark(entry['sig'], 'dequeued')
+    status = modify_buffer(param_dict_list[song], genre_tags[song], time_sigs[song], entry['level'], gs.new_song, entry['sig'])
+    gs.new_song = False
+    if status == 'late':
+        signals.retry(entry)
+    elif status == 'no_audio':
+        signals.retry(entry, song)
+    elif status == 'placed' and genre_tags[song] == 'pop':
+        with gs.pop_lock:
+            gs.pop_entry = (entry, song)
+
+# a pop signal waits in the jukebox source until its jump; if its song ends
+# first, it goes back to the scheduler for the next song
+def settle_pop(signals):
+    pending = gs.pop_entry
+    if pending is None:
+        return
+    entry, song = pending
+    with gs.pop_lock:
+        if gs.pop_entry is not pending:
             return
-
-        gs.audio_buffer[jkbx_ptr: jkbx_ptr + len(beat_buf)] = beat_buf
-        jkbx_ptr += len(beat_buf)
-
-        # subtlety settings
-        # only jump on down beat for level 0
-        if gs.pop_subtlety == 0:
-            is_jump_beat = (curr_beat['id'] % beat_multiple == 0) or (beats_since_last_jump >= max_beats_between_jumps)
-        # jump on any other beat for level 1 and level 2
-        else:
-            is_jump_beat = (not curr_beat['id'] % beat_multiple == 0) or (beats_since_last_jump >= max_beats_between_jumps)
-
-        # jump next or sequential next?
-        # in order to jump : (1) the alert must not have been addressed yet, (2) crossed the latency mark (just for consistency), and (3) must have suitable jump candidates
-
-        # if gs.pop_alert != previous_alert and gs.pop_subtlety == 2:
-        if gs.pop_subtlety == 2:
-            # CHANGE FOR STUDY PHASE 2:
-            print "JUMPING AT --> JUKEBOX PTR: ", jkbx_ptr
-
-            curr_beat = jukebox.beats[curr_beat['next']]
-
-            alert = param_dict['alert']
-
-            if len(curr_beat['buffer']) < gs.sr:
-                alert_length = int(np.floor(gs.sr / len(curr_beat['buffer']))) * len(curr_beat['buffer'])
-            else:
-                alert_length = len(curr_beat['buffer'])            
-            
-            alert = alert[:alert_length]
-
-
-            beat_buf = alert
-
-            # previous_alert = gs.pop_alert
-            gs.pop_subtlety = -1
-
-            beats_since_last_jump += 1
-
-
-        # elif gs.pop_alert != previous_alert and curr_beat['jump_candidates'] != [] and is_jump_beat:
-        elif ( gs.pop_subtlety == 1 or gs.pop_subtlety == 0 ) and curr_beat['jump_candidates'] != [] and is_jump_beat:
-            # where is jukebox ptr in relation to buffer pointer?
-            print "JUMPING AT --> JUKEBOX PTR: ", jkbx_ptr
-
-            if gs.pop_subtlety == 0:
-                filtered_candidates = [c for c in curr_beat['jump_candidates'] if jukebox.beats[c]['segment'] not in recent_segments]
-                if filtered_candidates == []: # if we can't maintain this rule, relax it
-                    filtered_candidates = curr_beat['jump_candidates']    
-            else:
-                filtered_candidates = curr_beat['jump_candidates']
-
-            # make the jump
-            jump_beat_index = np.random.choice(filtered_candidates)
-            curr_beat = jukebox.beats[jump_beat_index]
-            # window this signal and taper surrounding
-            beat_buf = beat_window(curr_beat['buffer'])
-            # taper_buffer_edges(jkbx_ptr, jkbx_ptr + len(beat_buf), 0.25)
-
-            # previous_alert = gs.pop_alert
-            gs.pop_subtlety = -1
-
-            beats_since_last_jump = 0
-        
-        else:
-            if curr_beat['next'] == None:
-                print "Jukebox thread reached end of track."
-                gs.audio_buffer = gs.audio_buffer[:jkbx_ptr]
-                break
-            else:
-                curr_beat = jukebox.beats[curr_beat['next']]
-     
-                beat_buf = curr_beat['buffer']
-
-                beats_since_last_jump += 1
-
-                # sleep only for non-jump 
-                # print "jkbx ptr currently at: ", jkbx_ptr
-                # print "current sleep time: ", sleep_time
-
-                if jkbx_ptr - gs.ptr <= 500000:
-                    sleep_time = max(sleep_time / 10.0, 0.001)
-                elif jkbx_ptr - gs.ptr >= 1000000:
-                    sleep_time = min(sleep_time * 8.0, 1.0)
-                else:
-                    pass
-                time.sleep(sleep_time)
-
-        if curr_beat['segment'] not in recent_segments:
-            recent_segments.append(curr_beat['segment'])
-        
-
-    print "Finished Jukebox thread.."
-    return
-
-# convert between int bytes format and float 32 samples
-def convert(in_buffer):
-    return (in_buffer.T.astype(np.float32)) /  np.iinfo(np.int16).max
+        if gs.pop_subtlety == -1 or gs.pop_song != song:
+            # landed
+            gs.pop_entry = None
+            return
+        if gs.song_index == song:
+            return
+        entry['level'] = max(entry['level'], gs.pop_subtlety)
+        gs.pop_signal = None
+        gs.pop_subtlety = -1
+        gs.pop_entry = None
+    signals.retry(entry, song)
 
 def start_server(host='localhost', port=8089):
     # server settings
@@ -309,10 +266,11 @@ def start_server(host='localhost', port=8089):
     serversocket.listen(1) # become a server socket, maximum 5 connections
     print "Please begin client application: "
     connection, address = serversocket.accept()
-    connection.settimeout(2)
+    # short, so the main loop gets back to the scheduler between messages
+    connection.settimeout(0.1)
     return connection, serversocket
 
-def preprocess(source_file_path='tracks/', list_file='info.csv'):
+def preprocess(source_file_path='tracks/', list_file='info.csv', streaming=False, render_variants=False, store_stft=False, compress_stft=False):
     # read tracks, genre tags, time signatures in from csv
     track_names = []
     genre_tags = []
@@ -338,30 +296,48 @@ def preprocess(source_file_path='tracks/', list_file='info.csv'):
     print time_sigs
     print "----------------------"
 
-    param_dict_list = []
     # check for missing genre tags and time sigs
     a = AS.Automatic_Sorting()
+    index = LI.Library_Index()
     for i, track_name in enumerate(track_names):
         print "Pre-processing track: ", i
         # check or compute genre/ time sig data
         genre_tags[i] = a.categorize_audio(track_names[i], genre_tags[i])
         time_sigs[i] = a.estimate_timesig(track_names[i], time_sigs[i])
 
-        preprocess_name = track_name.replace('tracks/','') + "_" + str(genre_tags[i]) + "_" + str(time_sigs[i]) + ".pkl"
+        preprocess_name = pre.artifact_name(track_name, genre_tags[i], time_sigs[i], source_file_path)
 
         # check if pre-computed data already exists
         if preprocess_name in os.listdir("preprocess_data/"):
             # load the data
             print "Found existing data, loading."
             param_dict = pickle.load(open("preprocess_data/" + preprocess_name, 'rb'))
+            # pop artifacts from before jump crossfades were stored
+            if genre_tags[i] == 'pop' and 'transitions' not in param_dict:
+                param_dict['transitions'] = pre.jump_transitions(param_dict['jukebox'], 22050)
+                pickle.dump(param_dict, open("preprocess_data/" + preprocess_name, 'wb'))
+            # artifacts from before the classical curves were packed
+            if 'tempo' in param_dict and 'curve_hop' not in param_dict:
+                param_dict = curves.pack(param_dict)
+                pickle.dump(param_dict, open("preprocess_data/" + preprocess_name, 'wb'))
         # pre-process the track alone
         else:
-            param_dict = pre.preprocess(track_names[i], genre_tags[i], time_sigs[i]) 
+            param_dict = pre.preprocess(track_names[i], genre_tags[i], time_sigs[i], streaming) 
             # save for later use
             pickle.dump(param_dict, open("preprocess_data/" + preprocess_name, 'wb'))
 
-        param_dict_list.append(param_dict)
-        
+        # optional stages, also run on artifacts from earlier runs
+        if store_stft and 'stft' not in param_dict and genre_tags[i] in ['jazz', 'classical']:
+            param_dict = pre.store_stft(track_names[i], genre_tags[i], param_dict, compress_stft)
+            pickle.dump(param_dict, open("preprocess_data/" + preprocess_name, 'wb'))
+        if render_variants and 'variants' not in param_dict and genre_tags[i] in ['jazz', 'classical']:
+            param_dict = pre.render_variants(track_names[i], genre_tags[i], param_dict)
+            pickle.dump(param_dict, open("preprocess_data/" + preprocess_name, 'wb'))
+
+        # keep the library index in step with the artifacts on disk
+        index.update(track_name.replace(source_file_path, ''), genre_tags[i], time_sigs[i], param_dict,
+            "preprocess_data/" + preprocess_name, a.reports.get(track_names[i]), source_file_path)
+
 
     print "Final Estimated Metadata: "
     print "----------------------"
@@ -371,10 +347,77 @@ def preprocess(source_file_path='tracks/', list_file='info.csv'):
     print "----------------------"
 
     pickle.dump((track_names, genre_tags, time_sigs), open('meta.pkl', 'wb'))
-    np.array(param_dict_list).dump('prep.dat')
+    audio_io.report()
     print "Finished Pre-processing."
 
 
+# (seconds into playback, level) rows of a signal script, in time order
+def read_script(script_file):
+    script = []
+    ifile = open(script_file, 'rb')
+    for row in csv.reader(ifile):
+        if len(row) < 2 or row[0].strip().startswith('#'):
+            continue
+        script.append((float(row[0]), int(row[1])))
+    ifile.close()
+    return sorted(script)
+
+# stand-in for the client: hand each scripted signal to the scheduler once
+# the sink has taken that much audio, and run what the scheduler lets go,
+# holding offline sinks until the modifier is done. signals runs on the
+# playback clock, so step is how far playback moves on while a signal waits
+# for a song to start
+def run_script(script, sink, stream_thread, modify_flag, signals, param_dict_list, genre_tags, time_sigs, step=0.1):
+    script = collections.deque(script)
+    while stream_thread.is_alive():
+        now = sink.frames / float(gs.sr)
+        while len(script) > 0 and script[0][0] <= now:
+            secs, level = script.popleft()
+            print "Scripted signal at %.1fs, level %d" % (secs, level)
+            signals.add(level, gs.latency.received(level))
+
+        settle_pop(signals)
+        entry = signals.next(gs.song_index) if modify_flag.is_set() else None
+        if entry is not None:
+            dispatch(signals, entry, param_dict_list, genre_tags, time_sigs)
+            continue
+        if len(script) == 0 and signals.pending == [] and gs.pop_entry is None:
+            break
+
+        # play on to the next scripted signal or the next the scheduler can let go
+        times = [script[0][0]] if len(script) > 0 else []
+        ready = signals.ready_at()
+        if ready is not None:
+            times.append(ready)
+        t = min(times)
+        if t <= now:
+            t = now + step
+        at = long(t * gs.sr)
+        sink.hold(at)
+        while sink.frames < at and stream_thread.is_alive():
+            time.sleep(0.001)
+
+    sink.hold(None)
+    signals.report()
+    while stream_thread.is_alive():
+        stream_thread.join(0.25)
+
+
+# write info.csv from already analysed tracks of one bucket
+def build_playlist(bucket, minutes, source_file_path='tracks/', list_file='info.csv'):
+    index = LI.Library_Index()
+    index.refresh(source_file_path)
+    rows = index.playlist(minutes * 60.0, bucket=bucket)
+    index.write_playlist(rows, list_file)
+    print "Wrote %d tracks (%.1f mins) to %s" % (len(rows), index.total_duration(rows) / 60.0, list_file)
+
+def validate_playlist(source_file_path='tracks/', list_file='info.csv'):
+    index = LI.Library_Index()
+    problems = index.validate_playlist(list_file, source_file_path)
+    for name, problem in problems:
+        print name, ": ", problem
+    if problems == []:
+        print "All tracks in", list_file, "are already analysed."
 
 
 if __name__ == "__main__":
@@ -383,21 +426,88 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('-preprocess', action='store_true')
     parser.add_argument('-start', action='store_true')
+    parser.add_argument('-stream', action='store_true')
+    parser.add_argument('-variants', action='store_true')
+    parser.add_argument('-speculate', action='store_true')
+    parser.add_argument('-stft', action='store_true')
+    parser.add_argument('-compress_stft', action='store_true')
+    parser.add_argument('-pitch_quality', type=str, default=vocoder.quality, choices=vocoder.QUALITY)
+    parser.add_argument('-resample', type=str, default=audio_io.resample_quality, choices=sorted(audio_io.RES_TYPES.keys()))
+    parser.add_argument('-playlist', type=str, default=None)
+    parser.add_argument('-minutes', type=float, default=60.0)
+    parser.add_argument('-validate', action='store_true')
+    parser.add_argument('-sink', type=str, default='pyaudio', choices=sinks.SINKS)
+    parser.add_argument('-out', type=str, default='render.wav')
+    parser.add_argument('-script', type=str, default=None)
+    parser.add_argument('-block', type=int, default=1024)
+    parser.add_argument('-ahead', type=float, default=0.5)
+    parser.add_argument('-native', action='store_true')
+    parser.add_argument('-storage', type=str, default='float32', choices=prefetch.STORAGE)
+    parser.add_argument('-burst', type=float, default=0.5)
+    parser.add_argument('-signal_gap', type=float, default=4.0)
+    parser.add_argument('-max_wait', type=float, default=60.0)
     args = parser.parse_args()
 
+    # build or check info.csv from the library index
+    if args.playlist:
+        build_playlist(args.playlist, args.minutes, source_file_path='tracks/', list_file='info.csv')
+    if args.validate:
+        validate_playlist(source_file_path='tracks/', list_file='info.csv')
+
 
     # initialize global variables 
     gs.init()
+    audio_io.resample_quality = args.resample
+    vocoder.quality = args.pitch_quality
 
     # preprocess
     if args.preprocess:
-        preprocess(source_file_path='tracks/', list_file='info.csv')
+        preprocess(source_file_path='tracks/', list_file='info.csv', streaming=args.stream, render_variants=args.variants, store_stft=args.stft, compress_stft=args.compress_stft)
 
     # realtime playback and modification
     if args.start:
-        param_dict_list = np.load("prep.dat")
         track_names, genre_tags, time_sigs = pickle.load(open('meta.pkl', 'rb'))
 
+        # play at the first track's own rate and channel count; analysis stays mono 22050
+        if args.native:
+            gs.sr, gs.channels = audio_io.native_format(track_names[0])
+
+        # param dicts are read from preprocess_data/ one track ahead of playback
+        param_dict_list = [None] * len(track_names)
+        prefetcher = prefetch.Track_Prefetcher(track_names, genre_tags, time_sigs, gs.sr, gs.channels, args.storage)
+
+        # preprocessing used to write every param dict to prep.dat instead
+        missing = prefetcher.missing()
+        if missing != []:
+            if os.path.exists('prep.dat'):
+                print "No preprocess_data/ artifacts for %d track(s), reading prep.dat instead. Run with -preprocess to write them." % len(missing)
+                prefetcher.legacy = np.load('prep.dat')
+            else:
+                print "No preprocessed data for: %s. Run with -preprocess first." % ", ".join(missing)
+                sys.exit(0)
+        prefetcher.prefetch(0)
+
+        sink = sinks.make_sink(args.sink, args.out)
+        gs.latency = latency.Latency_Tracker(gs.sr)
+        modify_flag = threading.Event()
+        end_stream = threading.Event()
+
+        # render likely modifier clips in the background while tracks play;
+        # realtime only, so offline renders stay the same from run to run
+        if args.speculate and sink.realtime:
+            gs.speculator = speculate.Speculator(param_dict_list, genre_tags, time_sigs)
+            gs.speculator.start()
+
+        # headless: signals come from a script instead of a client
+        if args.script is not None or not sink.realtime:
+            script = read_script(args.script) if args.script is not None else []
+            t1 = threading.Thread(target=stream_audio, args=(track_names,genre_tags,param_dict_list,modify_flag, end_stream, None, prefetcher, sink, args.block, args.ahead, ))
+            t1.daemon = True
+            t1.start()
+            signals = scheduler.Signal_Scheduler(args.burst, args.signal_gap, max_age_secs=args.max_wait, clock=lambda: sink.frames / float(gs.sr))
+            run_script(script, sink, t1, modify_flag, signals, param_dict_list, genre_tags, time_sigs)
+            sys.exit(0)
+
         # initialize server/ client
         try:
             connection, socket = start_server()
@@ -405,11 +515,7 @@ if __name__ == "__main__":
             print "Could not connect. Aborting.."
             sys.exit(0)
 
-        
-        modify_flag = threading.Event()
-        end_stream = threading.Event()
-        
-        t1 = threading.Thread(target=stream_audio, args=(track_names,genre_tags,param_dict_list,modify_flag, end_stream, connection, ))
+        t1 = threading.Thread(target=stream_audio, args=(track_names,genre_tags,param_dict_list,modify_flag, end_stream, connection, prefetcher, sink, args.block, args.ahead, ))
         t1.daemon = True
 
         t1.start()
@@ -418,50 +524,50 @@ if __name__ == "__main__":
         msg_length=5
 
         gs.new_song = True
+        signals = scheduler.Signal_Scheduler(args.burst, args.signal_gap, max_age_secs=args.max_wait)
+        mod_thread = None
 
         # terminate monitor thread if stream thread finishes
         while t1.is_alive():
             try:
                 msg = connection.recv(msg_length) 
-                gs.msg_q.appendleft(msg)
+                gs.msg_q.appendleft((msg, gs.latency.received() if msg.startswith('msg') else None))
             except:
                 pass
 
-           
-            # and we are allowed to modify
-            if modify_flag.is_set():
-                # if there is a msg
-                if len(gs.msg_q) > 0:
-                    msg = gs.msg_q.pop()
-                    if len(msg) == msg_length:
-                        header, level = msg.split(':')
-                        if header == 'end':
-                            # trigger the end of stream thread
-                            end_stream.set()
-                            break
-                        elif header == 'msg':
-                            level = int(level)
-
-                            try:
-                                is_alive = mod_thread.isAlive()
-                            except NameError:
-                                is_alive = False
-
-                            if not is_alive:
-                                mod_thread = threading.Thread(target=modify_buffer, args=(param_dict_list[gs.song_index], genre_tags[gs.song_index],time_sigs[gs.song_index],level,gs.new_song, ))
-                                mod_thread.daemon = True
-                                mod_thread.start()
-                                gs.new_song = False
-                        else:
-                            print "Message Error."
-                    else:
-                            print "Message Error." 
-
-                    
-            # we are not allowed to modify, during song load
-            else:
-                gs.new_song = True
-                time.sleep(3)
+            # every message goes to the scheduler as it arrives, whether or
+            # not a modifier could run right now
+            while len(gs.msg_q) > 0:
+                msg, sig = gs.msg_q.pop()
+                if len(msg) != msg_length:
+                    print "Message Error."
+                    continue
+                header, level = msg.split(':')
+                if header == 'end':
+                    # trigger the end of stream thread
+                    end_stream.set()
+                    break
+                elif header == 'msg':
+                    signals.add(int(level), sig)
+                else:
+                    print "Message Error."
+            if end_stream.is_set():
+                break
+
+            # one modifier at a time, and only once a song is playing
+            if not modify_flag.is_set():
+                time.sleep(0.05)
+                continue
+            settle_pop(signals)
+            if mod_thread is not None and mod_thread.is_alive():
+                continue
+            entry = signals.next(gs.song_index)
+            if entry is not None:
+                mod_thread = threading.Thread(target=dispatch, args=(signals, entry, param_dict_list, genre_tags, time_sigs, ))
+                mod_thread.daemon = True
+                mod_thread.start()
+
+        signals.report()
         try:
             connection.close()
             socket.shutdown(1)
@@ -13,76 +13,230 @@
 import numpy as np
 
 import librosa
-from scipy import signal
 import sklearn.cluster
 
 import global_settings as gs
+import audio_io
+import loudness
+import windows
+import variants
+import vocoder
+import curves
+import beat_index
 
 import time
 
-import pydub
+# (song index, source) of what is playing; song is read first so a
+# track change in between gives a stale song, whose edits are refused
+def playing():
+	song = gs.song_index
+	return song, gs.audio_buffer
 
-# modify global buffer in place 
+# float32 working copy of [start, stop) of the source, however it is stored
+def region(source, start, stop):
+	return audio_io.to_float32(source[start:stop])
+
+
+# gain edits around a range of the song
 #
 # \___/
 #
-def taper_buffer_edges(range_start, range_end, fade_time, high_end=1.0, low_end=0.3):
+# the ramp down is shortened to what the renderer can still edit (a block
+# past its editable point, as it keeps rendering while we submit), so a
+# range close to playback gets a quicker fade rather than a refused one
+def taper_buffer_edges(song, range_start, range_end, fade_time, high_end=1.0, low_end=0.3):
 	fade_samples = int(fade_time * gs.sr)
+	fade_samples_down = fade_samples
+	editable = gs.renderer.editable_from(song)
+	if editable is not None:
+		fade_samples_down = min(fade_samples, max(0, range_start - editable - gs.renderer.block_size))
+
 	# ramp down
-	ramp_down = np.array([(-1.0 * (high_end - low_end) / fade_samples) * x + high_end for x in range(fade_samples)])
-	gs.audio_buffer[range_start - fade_samples: range_start] *= ramp_down 
+	if fade_samples_down > 0:
+		gs.renderer.gain(song, range_start - fade_samples_down, range_start, windows.ramp(fade_samples_down, high_end, low_end))
 
 	#ramp up 
-	ramp_up = np.array([(-1.0 * (low_end - high_end) / fade_samples) * x + low_end for x in range(fade_samples)])
-	gs.audio_buffer[range_end: range_end + fade_samples] *= ramp_up
+	gs.renderer.gain(song, range_end, range_end + fade_samples, windows.ramp(fade_samples, low_end, high_end))
 
 	return 
 
 
-# modify global buffer in place 
+# modify signal in place 
 #  ___
 # /   \
 #
 def square_window(sig, high_end=1.0, low_end=0.5):
+	return windows.apply(sig, windows.trapezoid(len(sig), high_end, low_end), out=sig)
+
+# out=sig windows in place; out may also be a slice of a preallocated buffer
+def window(sig, out=None):
+	return windows.apply(sig, windows.gaussian(len(sig)), out=out)
+
+# a per-frame curve shaped to multiply sig, which may be (n, channels) frames
+def per_frame(curve, sig):
+	if sig.ndim == 1:
+		return curve
+	return curve[:, np.newaxis]
+
+# run a mono librosa effect on each channel of (n, channels) frames
+def per_channel(effect, sig):
+	if sig.ndim == 1:
+		return effect(sig)
+	return np.column_stack([effect(sig[:, c]) for c in range(sig.shape[1])])
+
+
+###################################
+# KERNELS: the heavy DSP, shared with pre-rendered variants
+###################################
+
+# stored stft frames for [start, stop) of the source, None if the artifact has none
+def stored_frames(param_dict, start, stop):
+	if 'stft' not in param_dict:
+		return None
+	return vocoder.frames(param_dict['stft'], start, stop)
+
+# pitch shifted, windowed copy of a float32 clip (jazz levels 0 and 1);
+# frames from stored_frames skip the forward stft
+def jazz_shift(clip, level, sr, frames=None):
+	n_steps = 4 if level == 0 else 6.5
+	if frames is not None and clip.ndim == 1:
+		shift_cut = vocoder.pitch_shift(clip, sr, n_steps, frames)
+	else:
+		shift_cut = per_channel(lambda y: vocoder.pitch_shift(y, sr, n_steps), clip)
+	if level == 1:
+		shift_cut *= 1.4
+	return window(shift_cut, out=shift_cut)
+
+# secs of source a classical level 1 clip covers at tempo_factor
+def classical_dur(tempo_factor, dur=4, offset=0.8):
+	return int(np.ceil(dur * (tempo_factor + offset)))
+
+# time compressed clip at the loudness of the one it replaces, without clipping;
+# frames from stored_frames skip the forward stft
+def classical_shrink(clip, tempo_factor, offset=0.8, frames=None):
+	if frames is not None and clip.ndim == 1:
+		shrink = vocoder.time_stretch(clip, offset + tempo_factor, frames)
+	else:
+		shrink = per_channel(lambda y: vocoder.time_stretch(y, offset + tempo_factor), clip)
+	return loudness.soft_limit(loudness.match_loudness(shrink, clip))
 
-	fade_samples = int(len(sig) * (1.0 / 8.0))
-
-	# ramp up
-	ramp_up = np.array([(-1.0 * (low_end - high_end) / fade_samples) * x + low_end for x in range(fade_samples)])
-	sig[:fade_samples] *= ramp_up
-
-	#ramp down
-	ramp_down = np.array([(-1.0 * (high_end - low_end) / fade_samples) * x + high_end for x in range(fade_samples)])
-	sig[-fade_samples:] *= ramp_down
-
-	return sig
-
-def window(sig):
-	return sig * signal.gaussian(len(sig), std=(2.0*len(sig)/ 8.0))
+# (sample the echo is added at, windowed echo) for a classical level 0 signal at nearest_bound
+def classical_echo(param_dict, source, nearest_bound, dur, sr):
+	offset = int(0.75 * sr)
+	clip = region(source, nearest_bound, nearest_bound + (dur*sr))
 
+	if param_dict['echo'] is not None:
+		echo_amp = curves.value(param_dict, 'echo', nearest_bound)
+	else:
+		echo_amp = 0.8
 
+	delay_in_secs = curves.value(param_dict, 'delay', nearest_bound)
+	delay_in_samps = int(delay_in_secs * sr)
+	delay_in_samps += offset
+	
+	# gs.audio_buffer[nearest_bound + delay_in_samps: nearest_bound + delay_in_samps + (dur*gs.sr)] += ((0.8*echo_amp) * window(clip))
+	# clip is already a working copy
+	window(clip, out=clip)
+	clip *= echo_amp
+	return nearest_bound + delay_in_samps, clip
+
+# blues level 0/1 overlay spanning nearest_beat[0] to nearest_beat[-1]
+def blues_overlay(overlay, nearest_beat, level):
+	if level == 0:
+		vol_fac = 1.8
+	else:
+		vol_fac = 3.2		
+
+	# one overlay buffer for all the beats, each beat filled in place
+	r_sample = np.zeros(nearest_beat[-1] - nearest_beat[0], dtype=np.float32)
+	for i in range(len(nearest_beat) - 1):
+		beat_start = nearest_beat[i] - nearest_beat[0]
+		beat_size = nearest_beat[i+1] - nearest_beat[i]
+		if len(overlay) >= beat_size:
+			r_sample[beat_start: beat_start + beat_size] = overlay[:beat_size]
+		else:
+			window(overlay, out=r_sample[beat_start: beat_start + len(overlay)])
+	r_sample *= vol_fac
+	return r_sample
+
+# (sample to edit at, stop, clip) for a level 0/1 signal at position, rendered
+# ahead of the signal; None where the clip would run off the end of the source
+def render_ahead(genre, level, param_dict, source, position, current_timesig, sr, dur=4):
+	if genre == 'jazz':
+		stop = position + dur * sr
+		if stop > len(source):
+			return None
+		return position, stop, jazz_shift(region(source, position, stop), level, sr, stored_frames(param_dict, position, stop))
+
+	elif genre == 'classical' and level == 1:
+		tempo_factor = curves.value(param_dict, 'tempo', position)
+		stop = position + classical_dur(tempo_factor, dur) * sr
+		if stop > len(source):
+			return None
+		return position, stop, classical_shrink(region(source, position, stop), tempo_factor, frames=stored_frames(param_dict, position, stop))
+
+	elif genre == 'classical':
+		if position + dur * sr > len(source):
+			return None
+		at, clip = classical_echo(param_dict, source, position, dur, sr)
+		return at, at + len(clip), clip
+
+	elif genre == 'blues':
+		nearest_beat = beat_index.of(param_dict, current_timesig).next_beats(position, 2 * int(current_timesig))
+		if len(nearest_beat) < 2:
+			return None
+		clip = blues_overlay(param_dict['overlay'], nearest_beat, level)
+		return nearest_beat[0], nearest_beat[0] + len(clip), clip
+
+	return None
+
+# signals served with a ready-made clip; main keeps them out of its
+# processing time estimate
+ready_hits = 0
+
+# (sample to edit at, stop, clip) made ahead of time for this signal: a
+# pre-rendered variant, or else one the speculative worker has ready. Clips
+# need no processing time, so they may land from a block past the renderer's
+# editable point
+def ready_made(param_dict, level, start):
+	global ready_hits
+	editable = gs.renderer.editable_from(gs.song_index)
+	earliest = None if editable is None else min(start, editable + gs.renderer.block_size)
+	ready = variants.lookup(param_dict, level, start, earliest)
+	if ready is None and gs.speculator is not None:
+		ready = gs.speculator.take(gs.song_index, level, start, earliest)
+	if ready is not None:
+		ready_hits += 1
+	return ready
+
+
+# every modifier returns the sample its edit starts at, or None if the renderer
+# had already passed it
 def modify_jazz(level, param_dict, start, dur=4, segment=False):
 	# TODO: shift-by
 	print "Jazz modification begun.."
+	song, source = playing()
 
 	if segment:
 		# use pre-computed segment boundaries
-		start_bounds = param_dict['bounds'][:,0]
-		nearest_bound = start_bounds[np.where(start_bounds >= start)][0]
+		nearest_bound = beat_index.of(param_dict).next_segment(start)
 	else:
 		# use pre-computer beat boundaries
-		beats = param_dict['beats']
-		nearest_beat = beats[np.where(beats >= start)][0:2]
+		nearest_beat = beat_index.of(param_dict).next_beats(start, 2)
 		nearest_bound = nearest_beat[0]
 
-	# pitch shift sample
-	if level == 0:
-		shift_cut = 1.0 * librosa.effects.pitch_shift(gs.audio_buffer[nearest_bound: nearest_bound + (dur * gs.sr)], gs.sr, n_steps=4)
-		gs.audio_buffer[nearest_bound: nearest_bound + (dur * gs.sr)] = window(shift_cut) + gs.audio_buffer[nearest_bound: nearest_bound + (dur * gs.sr)]
+	ready = ready_made(param_dict, level, start) if level != 2 and not segment else None
 
-	elif level == 1:
-		shift_cut = 1.4 * librosa.effects.pitch_shift(gs.audio_buffer[nearest_bound: nearest_bound + (dur * gs.sr)], gs.sr, n_steps=6.5)
-		gs.audio_buffer[nearest_bound: nearest_bound + (dur * gs.sr)] = window(shift_cut) + gs.audio_buffer[nearest_bound: nearest_bound + (dur * gs.sr)]
+	# pre-rendered pitch shift
+	if ready is not None:
+		nearest_bound, _, shift_cut = ready
+		done = gs.renderer.add(song, nearest_bound, shift_cut)
+
+	# pitch shift sample
+	elif level == 0 or level == 1:
+		stop = nearest_bound + (dur * gs.sr)
+		shift_cut = jazz_shift(region(source, nearest_bound, stop), level, gs.sr, stored_frames(param_dict, nearest_bound, stop))
+		done = gs.renderer.add(song, nearest_bound, shift_cut)
 	else:
 		# issue sampled alert
 		alert = param_dict['alert']
@@ -90,63 +244,56 @@ def modify_jazz(level, param_dict, start, dur=4, segment=False):
 		if len(alert) >= beat_size:
 			alert_samp = alert[:beat_size]
 		else:
-			alert_samp = np.concatenate((window(alert),np.zeros((beat_size - len(alert)))))
-		gs.audio_buffer[nearest_beat[0]:nearest_beat[1]] = alert_samp
+			alert_samp = np.zeros(beat_size, dtype=np.float32)
+			window(alert, out=alert_samp[:len(alert)])
+		done = gs.renderer.replace(song, nearest_beat[0], alert_samp)
+		nearest_bound = nearest_beat[0]
 
+	if not done:
+		print "Jazz modification arrived too late.."
+		return None
 	print "Jazz modification completed.."
-	return True
-
-def match_target_amplitude(sound, target_dBFS):
-    change_in_dBFS = target_dBFS - sound.dBFS
-    return sound.apply_gain(change_in_dBFS)
-
+	return nearest_bound
 
 def modify_classical(level, param_dict, start, dur=4, sig_dur=4, segment=False):
 	print "Classical modification begun.."
+	song, source = playing()
 
 	# snap to segment or start marker
 	if segment:
 		# use pre-computed segment boundaries
-		start_bounds = param_dict['bounds'][:,0]
-		nearest_bound = start_bounds[np.where(start_bounds >= start)][0]
+		nearest_bound = beat_index.of(param_dict).next_segment(start)
 	else:
 		# simply use start marker
 		nearest_bound = start
 
-	# level 1 - tempo change -- volume envelope needs fixing!!
-	if level == 1:
-		offset = 0.8
-		# in frames, conversion to samples required
-		tempo_curve = param_dict['tempo']
-		nearest_bound_in_frame = librosa.samples_to_frames([nearest_bound])[0]
-		tempo_factor = tempo_curve[nearest_bound_in_frame]
+	ready = ready_made(param_dict, level, start) if level != 2 and not segment else None
 
-		# change dur to account for tempo factor
-		dur = int(np.ceil(dur * (tempo_factor + offset)))
+	# level 1, made ahead
+	if ready is not None and level == 1:
+		nearest_bound, stop, shrink = ready
+		done = gs.renderer.splice(song, nearest_bound, stop, shrink)
 
-		clip = gs.audio_buffer[nearest_bound : nearest_bound + (dur*gs.sr)]
+	# level 0, made ahead
+	elif ready is not None:
+		nearest_bound, _, clip = ready
+		done = gs.renderer.add(song, nearest_bound, clip)
 
-		shrink = librosa.effects.time_stretch(clip, offset + tempo_factor)
+	# level 1 - tempo change -- volume envelope needs fixing!!
+	elif level == 1:
+		tempo_factor = curves.value(param_dict, 'tempo', nearest_bound)
 
+		# change dur to account for tempo factor
+		dur = classical_dur(tempo_factor, dur)
 
-		# normalizing CRAP. 
-		librosa.output.write_wav("clip.wav", clip, gs.sr)
-		as_clip = pydub.AudioSegment.from_wav("clip.wav")
-		as_amp = as_clip.dBFS
-		librosa.output.write_wav("shrink.wav", shrink, gs.sr)
-		shrink = match_target_amplitude(pydub.AudioSegment.from_wav("shrink.wav"), as_amp)
-		shrink.export("new_shrink.wav", format="wav")
-		shrink, sr = librosa.load("new_shrink.wav")
-		
-		compensate_factor = 1.2
+		stop = nearest_bound + (dur*gs.sr)
+		clip = region(source, nearest_bound, stop)
+		shrink = classical_shrink(clip, tempo_factor, frames=stored_frames(param_dict, nearest_bound, stop))
 
-		remainder = np.concatenate((shrink, gs.audio_buffer[nearest_bound + (dur*gs.sr):]))
-		
-		gs.audio_buffer[nearest_bound : nearest_bound + len(remainder)] = remainder
-		
-		gs.audio_buffer[-1 * (len(clip) - len(shrink)):] = 0
+		# the rest of the song moves up behind the shorter clip
+		done = gs.renderer.splice(song, nearest_bound, nearest_bound + len(clip), shrink)
 
-		# taper_buffer_edges(nearest_bound, nearest_bound + len(shrink), 1.0)
+		# taper_buffer_edges(song, nearest_bound, nearest_bound + len(shrink), 1.0)
 		
 
 		# if stretch instead of shrink		
@@ -155,23 +302,8 @@ def modify_classical(level, param_dict, start, dur=4, sig_dur=4, segment=False):
 
 	# level 0 - echo with delay
 	elif level == 0:
-		offset = int(0.75 * gs.sr)
-		clip = gs.audio_buffer[nearest_bound : nearest_bound + (dur*gs.sr)]
-
-		echo_amp_curve = param_dict['echo']
-		if echo_amp_curve != None:
-			echo_amp = echo_amp_curve[nearest_bound]
-		else:
-			echo_amp = 0.8
-
-		delay_curve = param_dict['delay']
-		nearest_bound_in_frame = librosa.samples_to_frames([nearest_bound])[0]
-		delay_in_secs = delay_curve[nearest_bound_in_frame]
-		delay_in_samps = int(delay_in_secs * gs.sr)
-		delay_in_samps += offset
-		
-		# gs.audio_buffer[nearest_bound + delay_in_samps: nearest_bound + delay_in_samps + (dur*gs.sr)] += ((0.8*echo_amp) * window(clip))
-		gs.audio_buffer[nearest_bound + delay_in_samps: nearest_bound + delay_in_samps + (dur*gs.sr)] += ((echo_amp) * window(clip))
+		nearest_bound, clip = classical_echo(param_dict, source, nearest_bound, dur, gs.sr)
+		done = gs.renderer.add(song, nearest_bound, clip)
 
 	# level 2 - alert sample
 	else:
@@ -180,57 +312,48 @@ def modify_classical(level, param_dict, start, dur=4, sig_dur=4, segment=False):
 		if len(alert) > sig_dur * gs.sr:
 			alert = alert[:sig_dur * gs.sr]
 
-		remainder = np.concatenate((square_window(alert), gs.audio_buffer[nearest_bound + len(alert):]))		
-		gs.audio_buffer[nearest_bound:nearest_bound + len(remainder)] = remainder
-		taper_buffer_edges(nearest_bound, nearest_bound + len(alert), 1.0, low_end=0.0)
+		# windowed on a copy, param_dict['alert'] is reused by every signal
+		done = gs.renderer.replace(song, nearest_bound, square_window(np.copy(alert)))
+		taper_buffer_edges(song, nearest_bound, nearest_bound + len(alert), 1.0, low_end=0.0)
 
+	if not done:
+		print "Classical modification arrived too late.."
+		return None
 	print "Classical modification completed.."
-	return True
+	return nearest_bound
 
-def modify_pop(level, param_dict, start, dur=2):
-	# write the new start value to the pop song alert flag
-	# jukebox thread should change the next beat
-	# gs.pop_alert = start
+# the jukebox source changes the next beat it hands the renderer, wherever
+# that is, so pop needs no start
+def modify_pop(level):
 	gs.pop_subtlety = level
 
-	return True
-
 
 def modify_blues(level, param_dict, start, current_timesig):
 	def average_amplitude(sig):
 		return np.mean(np.abs(sig))
 
 	print "Blues modification begun.."
+	song, source = playing()
 
 	start_time = time.time()
 
 	mult = 2
 	c_time_sig = int(current_timesig)
 	N = mult * c_time_sig
-	beats = param_dict['beats']
-	nearest_beat = beats[np.where(beats >= start)][0:N]
+	nearest_beat = beat_index.of(param_dict, current_timesig).next_beats(start, N)
+	ready = ready_made(param_dict, level, start) if level != 2 else None
 	
-	if level == 0 or level == 1:
-		# 4 beats, equal volume
+	if ready is not None:
+		at, _, r_sample = ready
+		nearest_beat = [at]
+		done = gs.renderer.add(song, at, r_sample)
 
-		if level == 0:
-			vol_fac = 1.8
-		else:
-			vol_fac = 3.2		
-
-		r_sample = []
-		overlay = param_dict['overlay']
-		for i in range(len(nearest_beat) - 1):
-			beat_size = nearest_beat[i+1] - nearest_beat[i]
-			if len(overlay) >= beat_size:
-				beat_samp = overlay[:beat_size]
-			else:
-				beat_samp = np.concatenate((window(overlay),np.zeros((beat_size - len(overlay)))))
-
-			r_sample = np.concatenate((r_sample, beat_samp))
+	elif level == 0 or level == 1:
+		# 4 beats, equal volume
+		r_sample = blues_overlay(param_dict['overlay'], nearest_beat, level)
 
-		# vol_equalizing = average_amplitude(gs.audio_buffer[nearest_beat[0]:nearest_beat[N-1]]) / average_amplitude(r_sample)
-		gs.audio_buffer[nearest_beat[0]:nearest_beat[N-1]] = (vol_fac * r_sample) + gs.audio_buffer[nearest_beat[0]:nearest_beat[N-1]]
+		# vol_equalizing = average_amplitude(source[nearest_beat[0]:nearest_beat[N-1]]) / average_amplitude(r_sample)
+		done = gs.renderer.add(song, nearest_beat[0], r_sample)
 
 	else:
 		# issue sampled alert
@@ -247,17 +370,55 @@ def modify_blues(level, param_dict, start, current_timesig):
 				num_alert_beats -= 1
 
 		# sample is either the size of largest possible beat or its entire size
-		gs.audio_buffer[nearest_beat[0]:nearest_beat[0] + len(alert_samp)] = alert_samp #+ gs.audio_buffer[nearest_beat[0]:nearest_beat[1]]
+		done = gs.renderer.replace(song, nearest_beat[0], alert_samp) #+ source[nearest_beat[0]:nearest_beat[1]]
 
 		# taper surrounding edges
-		taper_buffer_edges(nearest_beat[0], nearest_beat[0] + len(alert_samp), 1.0)
-
-		print len(alert_samp)
-		print nearest_beat[0]
+		taper_buffer_edges(song, nearest_beat[0], nearest_beat[0] + len(alert_samp), 1.0)
 
+	if not done:
+		print "Blues modification arrived too late.."
+		return None
 	print "Blues modification ended.."
-	return True
+	return nearest_beat[0]
 
 if __name__ == "__main__":
-	# timing specs on each module here
-	pass
\ No newline at end of file
+	# timing specs on each module here: time per modification near the start,
+	# middle and end of a long song should not depend on the position
+	import render
+
+	gs.init()
+	sr = gs.sr
+	n = 20 * 60 * sr
+	rng = np.random.RandomState(0)
+	source = (0.1 * rng.randn(n)).astype(np.float32)
+	alert = (0.1 * rng.randn(2 * sr)).astype(np.float32)
+	beats = np.arange(0, n, sr // 2)
+	frames = n // curves.CURVE_HOP + 1
+
+	gs.renderer = render.Renderer(sr)
+	gs.renderer.queue(source, 0)
+	gs.audio_buffer = source
+	gs.song_index = 0
+
+	jazz = {'beats': beats, 'alert': alert}
+	blues = {'beats': beats, 'alert': alert, 'overlay': alert[:sr // 4]}
+	classical = {'tempo': np.full(frames, 0.5, dtype=np.float32), 'delay': np.full(frames, 0.5, dtype=np.float32), 'echo': None,
+		'curve_hop': curves.CURVE_HOP, 'alert': alert}
+
+	timings = []
+	for name, modify in [('jazz 0', lambda s: modify_jazz(0, jazz, s)),
+			('jazz 2', lambda s: modify_jazz(2, jazz, s)),
+			('classical 0', lambda s: modify_classical(0, classical, s)),
+			('classical 1', lambda s: modify_classical(1, classical, s)),
+			('classical 2', lambda s: modify_classical(2, classical, s)),
+			('blues 0', lambda s: modify_blues(0, blues, s, 4)),
+			('blues 2', lambda s: modify_blues(2, blues, s, 4))]:
+		times = []
+		for position in [0.05, 0.5, 0.9]:
+			start_time = time.time()
+			modify(int(position * n))
+			times.append(time.time() - start_time)
+		timings.append((name, times))
+
+	for name, times in timings:
+		print "%s: start %.4fs, middle %.4fs, end %.4fs" % (name, times[0], times[1], times[2])
\ No newline at end of file
@@ -0,0 +1,205 @@
+#####################################
+# Music Signaling Pipeline Prototype
+#   Parallel DSP: run the time-local
+#   analysis stages of one long track
+#   in overlapping blocks across a
+#   worker pool
+#
+# Author: Ishwarya Ananthabhotla
+######################################
+
+# Every stage here is local in time: an STFT frame only sees n_fft samples,
+# the harmonic median filter only sees kernel_size frames, and an ISTFT
+# sample only sees the frames overlapping it. Each block is therefore
+# computed with pad_frames of extra context on both sides and only its core
+# is kept. Block edges are aligned to hop_length so block frames line up
+# with the frames of the single-pass result.
+#
+# Stages that depend on the whole track (power_to_db's top_db clip,
+# onset/ mfcc post-processing) run once on the stitched spectrogram.
+#
+# Tolerance against the single-pass librosa call on the same signal:
+#   hpss/ harmonic:           max abs error <= 1e-5 (float32 round-off)
+#   melspectrogram:           max rel error <= 1e-5
+#   onset_strength/ mfcc:     max abs error <= 1e-4 (computed on the above)
+#   chroma_stft:              max abs error <= 1e-4 when tuning is passed in;
+#                             with tuning=None it is estimated from at most
+#                             tuning_secs of evenly spread blocks and may differ
+#                             from the full-track estimate by a few hundredths
+#                             of a bin.
+#
+# Tracks shorter than min_parallel_secs skip the pool and call librosa directly.
+
+import multiprocessing
+
+import numpy as np
+import librosa
+
+min_parallel_secs = 600.0
+
+# signal shared with forked workers, which slice it by index
+_signal = None
+
+
+def num_workers(n_jobs=None):
+    if n_jobs is None:
+        return multiprocessing.cpu_count()
+    return max(1, n_jobs)
+
+
+def use_pool(y, sr, n_jobs):
+    return num_workers(n_jobs) > 1 and len(y) >= min_parallel_secs * sr
+
+
+# (start, stop, core_start, core_stop) in samples, all multiples of hop_length
+# except the final stop
+def block_bounds(n, hop_length, block_frames, pad_frames):
+    bounds = []
+    step = block_frames * hop_length
+    pad = pad_frames * hop_length
+    for core_start in range(0, n, step):
+        core_stop = min(n, core_start + step)
+        bounds.append((max(0, core_start - pad), min(n, core_stop + pad), core_start, core_stop))
+    return bounds
+
+
+# block-local frame range holding a block's core
+def core_frames(bounds, n, hop_length):
+    start, stop, core_start, core_stop = bounds
+    f0 = core_start // hop_length
+    if core_stop < n:
+        f1 = core_stop // hop_length
+    else:
+        f1 = 1 + n // hop_length
+    return f0 - start // hop_length, f1 - start // hop_length
+
+
+def map_blocks(func, y, tasks, n_jobs):
+    global _signal
+    _signal = y
+    try:
+        if num_workers(n_jobs) == 1:
+            results = map(func, tasks)
+        else:
+            pool = multiprocessing.Pool(num_workers(n_jobs))
+            try:
+                results = pool.map(func, tasks)
+            finally:
+                pool.close()
+                pool.join()
+    finally:
+        _signal = None
+    return results
+
+
+###################################
+# WORKERS
+###################################
+
+def _hpss_block(task):
+    start, stop, core_start, core_stop, kwargs = task
+    harm, perc = librosa.effects.hpss(_signal[start:stop], **kwargs)
+    return harm[core_start - start: core_stop - start], perc[core_start - start: core_stop - start]
+
+def _mel_block(task):
+    start, stop, f0, f1, sr, kwargs = task
+    S = librosa.feature.melspectrogram(y=_signal[start:stop], sr=sr, **kwargs)
+    return S[:, f0:f1]
+
+def _chroma_block(task):
+    start, stop, f0, f1, sr, kwargs = task
+    C = librosa.feature.chroma_stft(y=_signal[start:stop], sr=sr, **kwargs)
+    return C[:, f0:f1]
+
+
+###################################
+# STAGES
+###################################
+
+def hpss(y, sr=22050, n_jobs=None, block_secs=60.0, pad_frames=32, hop_length=512, **kwargs):
+    if not use_pool(y, sr, n_jobs):
+        return librosa.effects.hpss(y, **kwargs)
+
+    block_frames = int(block_secs * sr / hop_length)
+    tasks = [b + (kwargs,) for b in block_bounds(len(y), hop_length, block_frames, pad_frames)]
+    results = map_blocks(_hpss_block, y, tasks, n_jobs)
+
+    return np.concatenate([r[0] for r in results]), np.concatenate([r[1] for r in results])
+
+def harmonic(y, sr=22050, n_jobs=None, **kwargs):
+    return hpss(y, sr, n_jobs, **kwargs)[0]
+
+def frame_tasks(y, sr, block_secs, pad_frames, hop_length, kwargs):
+    block_frames = int(block_secs * sr / hop_length)
+    tasks = []
+    for b in block_bounds(len(y), hop_length, block_frames, pad_frames):
+        f0, f1 = core_frames(b, len(y), hop_length)
+        tasks.append((b[0], b[1], f0, f1, sr, kwargs))
+    return tasks
+
+def melspectrogram(y, sr=22050, n_jobs=None, block_secs=60.0, pad_frames=8, hop_length=512, **kwargs):
+    kwargs['hop_length'] = hop_length
+    if not use_pool(y, sr, n_jobs):
+        return librosa.feature.melspectrogram(y=y, sr=sr, **kwargs)
+
+    results = map_blocks(_mel_block, y, frame_tasks(y, sr, block_secs, pad_frames, hop_length, kwargs), n_jobs)
+    return np.hstack(results)
+
+# same as librosa.onset.onset_strength with the default mel feature;
+# pass S (log-power mel) to share one spectrogram with mfcc
+def onset_strength(y=None, sr=22050, S=None, n_jobs=None, **kwargs):
+    if S is None:
+        if not use_pool(y, sr, n_jobs):
+            return librosa.onset.onset_strength(y=y, sr=sr, **kwargs)
+        S = log_melspectrogram(y, sr, n_jobs)
+    return librosa.onset.onset_strength(S=S, sr=sr, **kwargs)
+
+def mfcc(y=None, sr=22050, S=None, n_jobs=None, **kwargs):
+    if S is None:
+        if not use_pool(y, sr, n_jobs):
+            return librosa.feature.mfcc(y=y, sr=sr, **kwargs)
+        S = log_melspectrogram(y, sr, n_jobs)
+    return librosa.feature.mfcc(S=S, sr=sr, **kwargs)
+
+# shared front end of mfcc and onset_strength (fmax=sr/2 for both at 22050)
+def log_melspectrogram(y, sr=22050, n_jobs=None):
+    return librosa.power_to_db(melspectrogram(y, sr, n_jobs, fmax=sr / 2.0))
+
+def chroma_stft(y, sr=22050, n_jobs=None, tuning=None, block_secs=60.0, pad_frames=8, hop_length=512, tuning_secs=120.0, **kwargs):
+    kwargs['hop_length'] = hop_length
+    if not use_pool(y, sr, n_jobs):
+        return librosa.feature.chroma_stft(y=y, sr=sr, tuning=tuning, **kwargs)
+
+    # tuning is a whole-track statistic; estimate it from a spread of block cores
+    if tuning is None:
+        bounds = block_bounds(len(y), hop_length, int(block_secs * sr / hop_length), pad_frames)
+        stride = max(1, int(np.ceil(len(bounds) * block_secs / tuning_secs)))
+        cores = [y[b[2]:b[3]] for b in bounds[::stride]]
+        tuning = librosa.estimate_tuning(y=np.concatenate(cores), sr=sr, bins_per_octave=kwargs.get('n_chroma', 12))
+
+    kwargs['tuning'] = tuning
+    tasks = frame_tasks(y, sr, block_secs, pad_frames, hop_length, kwargs)
+
+    results = map_blocks(_chroma_block, y, tasks, n_jobs)
+    return np.hstack(results)
+
+
+if __name__ == "__main__":
+    # compare block-parallel stages to single-pass librosa on a long track
+    import sys
+    import time
+
+    import audio_io
+    y, sr = audio_io.load(sys.argv[1])
+    min_parallel_secs = 0.0
+
+    for name, block, single in [('hpss', lambda: hpss(y, sr)[0], lambda: librosa.effects.hpss(y)[0]),
+            ('onset_strength', lambda: onset_strength(y, sr), lambda: librosa.onset.onset_strength(y=y, sr=sr)),
+            ('mfcc', lambda: mfcc(y, sr), lambda: librosa.feature.mfcc(y=y, sr=sr)),
+            ('chroma_stft', lambda: chroma_stft(y, sr, tuning=0.0), lambda: librosa.feature.chroma_stft(y=y, sr=sr, tuning=0.0))]:
+        t0 = time.time()
+        a = block()
+        t1 = time.time()
+        b = single()
+        t2 = time.time()
+        print "%s: parallel %.2fs, single %.2fs, max abs err %g" % (name, t1 - t0, t2 - t1, np.max(np.abs(a - b)))
@@ -12,7 +12,6 @@ import numpy as np
 # Librosa for audio
 import librosa
 
-from scipy import signal
 import sklearn.cluster
 
 # from VS pipeline
@@ -22,13 +21,39 @@ import os
 # remixatron
 import Remixatron as R
 
+# block-parallel analysis for long tracks
+import parallel_dsp as pdsp
+
+# bounded-memory analysis
+import stream_features as sf
+
+# cached fades and windows
+import windows
+
+# classical curves on one frame grid
+import curves
+
+# pre-rendered modifier clips
+import variants
+import modify_buffer as mb
+import vocoder
+
+# decode layer
+import audio_io
+
 # TEST
 import time
 
 import sys
 
-def preprocess(track_name, genre_tag, time_sig):
-    track, sr = librosa.load(track_name)
+def preprocess(track_name, genre_tag, time_sig, streaming=False):
+    if streaming and genre_tag in ['jazz', 'blues', 'classical']:
+        return feature_extract_streaming(track_name, genre_tag, time_sig)
+    elif genre_tag == 'pop':
+        # the jukebox decodes the track itself
+        return feature_extract_pop(track_name, 22050)
+
+    track, sr = audio_io.load(track_name)
     track, _ = librosa.effects.trim(track)
     if genre_tag == 'jazz':
         param_dict = feature_extract_jazz(track, sr)
@@ -36,8 +61,6 @@ def preprocess(track_name, genre_tag, time_sig):
         param_dict = feature_extract_blues(track, sr, time_sig)
     elif genre_tag == 'classical':
         param_dict = feature_extract_classical(track, sr)
-    elif genre_tag == 'pop':
-        param_dict = feature_extract_pop(track_name, sr)
     else:
         # implement classification for misc
         print "Error: Genre Keyword"
@@ -45,13 +68,53 @@ def preprocess(track_name, genre_tag, time_sig):
 
     return param_dict
 
+# add the whole track's stft to a jazz or classical param_dict, so the pitch
+# shift and time stretch can skip their forward stft (see vocoder.py)
+def store_stft(track_name, genre_tag, param_dict, compress=False):
+    if genre_tag not in ['jazz', 'classical']:
+        return param_dict
+
+    track, sr = audio_io.load(track_name)
+    track, _ = librosa.effects.trim(track)
+    param_dict['stft'] = vocoder.store(track, compress)
+    print "Stored STFT, %.1f MB" % ((param_dict['stft']['mag'].nbytes + param_dict['stft']['phase'].nbytes) / 1e6)
+    return param_dict
+
+# add pre-rendered jazz level 0/1 and classical level 1 clips to param_dict
+# (see variants.py); other genres have no heavy modifiers and are left as is
+def render_variants(track_name, genre_tag, param_dict, spacing_secs=variants.SPACING_SECS, dur=4):
+    if genre_tag not in ['jazz', 'classical']:
+        return param_dict
+
+    track, sr = audio_io.load(track_name)
+    track, _ = librosa.effects.trim(track)
+    spacing = int(spacing_secs * sr)
+    levels = {}
+
+    if genre_tag == 'jazz':
+        positions = variants.grid(param_dict['beats'], spacing)
+        for level in [0, 1]:
+            levels[level] = variants.table(positions,
+                lambda p, level=level: mb.render_ahead(genre_tag, level, param_dict, track, p, None, sr, dur), spacing)
+    else:
+        levels[1] = variants.table(np.arange(0, len(track), spacing),
+            lambda p: mb.render_ahead(genre_tag, 1, param_dict, track, p, None, sr, dur), spacing)
+
+    param_dict['variants'] = levels
+    print "Pre-rendered %d clips, %.1f MB" % (sum(len(t['clips']) for t in levels.values()), variants.size(param_dict) / 1e6)
+    return param_dict
+
+# file name of a track's cached param dict in preprocess_data/
+def artifact_name(track_name, genre_tag, time_sig, source_file_path='tracks/'):
+    return track_name.replace(source_file_path, '') + "_" + str(genre_tag) + "_" + str(time_sig) + ".pkl"
+
 
 ###################################
 # PROCESSING FOR TAGGED JAZZ
 ###################################
 
 def window_signal(sig):
-    return sig * signal.gaussian(len(sig), std=(2.0*len(sig)/ 8.0))
+    return windows.apply(sig, windows.gaussian(len(sig)))
 
 def boundaries_to_intervals(boundaries):
     intervals = []
@@ -59,12 +122,9 @@ def boundaries_to_intervals(boundaries):
         l = [boundaries[i], boundaries[i+1]]
         intervals.append(l)
     return np.array(intervals)
-    
 
-# return dict of features for jazz modifications
-def feature_extract_jazz(jazz_track, sr, num_segments=8, seg_thresh=3):
-    # segment boundaries
-    mfcc = librosa.feature.mfcc(y=jazz_track, sr=sr)
+# agglomerative segments of an mfcc, dropping those shorter than seg_thresh secs
+def segment_intervals(mfcc, sr, num_segments, seg_thresh):
     bounds = librosa.segment.agglomerative(mfcc, num_segments)
     sample_bounds = librosa.frames_to_samples(bounds)
     sample_intervals = boundaries_to_intervals(sample_bounds)
@@ -74,14 +134,21 @@ def feature_extract_jazz(jazz_track, sr, num_segments=8, seg_thresh=3):
     for i, intr in enumerate(sample_intervals):
         if intr[1] - intr[0] < seg_thresh * sr:
             del_list.append(i)
-    sample_intervals = np.delete(sample_intervals, del_list, axis=0)
+    return np.delete(sample_intervals, del_list, axis=0)
+    
+
+# return dict of features for jazz modifications
+def feature_extract_jazz(jazz_track, sr, num_segments=8, seg_thresh=3):
+    # segment boundaries
+    mfcc = pdsp.mfcc(y=jazz_track, sr=sr)
+    sample_intervals = segment_intervals(mfcc, sr, num_segments, seg_thresh)
     
     # corresponding intervals
     #   TODO: determine segment key/ progression
     shift_by = []
     
     # extracted subsample - using VS pipeline
-    jazz_harm, jazz_perc = librosa.effects.hpss(jazz_track)
+    jazz_harm, jazz_perc = pdsp.hpss(jazz_track, sr)
     try:
         rep_samples_audio, num_seg = extract.extract_sample(jazz_harm, sr, 1)
         signal_sample = rep_samples_audio[0][0]
@@ -89,9 +156,10 @@ def feature_extract_jazz(jazz_track, sr, num_segments=8, seg_thresh=3):
         print "Could not extract sample from VS Pipeline, using default.."
         mdpt = int(len(jazz_harm)/2)
         signal_sample = jazz_harm[mdpt : mdpt + sr]
+    del jazz_harm
     
     # extract beats to overlay VS sample
-    onset_env = librosa.onset.onset_strength(jazz_perc, sr=sr,
+    onset_env = pdsp.onset_strength(jazz_perc, sr=sr,
         aggregate=np.median)
     _, beats = librosa.beat.beat_track(onset_envelope=onset_env,
         sr=sr)
@@ -103,17 +171,11 @@ def feature_extract_jazz(jazz_track, sr, num_segments=8, seg_thresh=3):
 # PROCESSING FOR TAGGED BLUES/ RHYTHMIC
 ########################################
 
-def feature_extract_blues(blues_track, sr, current_timesig, onset_threshold=0.7):
-    # get rhythm overlay
-    hop_length = 512
-    blues_harm, blues_perc = librosa.effects.hpss(blues_track, margin=(1.0, 5.0))
-    onset_env = librosa.onset.onset_strength(blues_perc, sr=sr,
-        aggregate=np.median)
-    _, beats = librosa.beat.beat_track(onset_envelope=onset_env,
-        sr=sr)
-    
+# sample range of the 3 beats starting at the strongest onset
+def strongest_beats(onset_env, beats, sr, hop_length=512):
     times = librosa.frames_to_time(np.arange(len(onset_env)),
     sr=sr, hop_length=hop_length)
+    norm_onset_env = librosa.util.normalize(onset_env)
     
     prev_val = 0
 
@@ -121,17 +183,28 @@ def feature_extract_blues(blues_track, sr, current_timesig, onset_threshold=0.7)
         # get the corresponding onset env value
         t_b = times[b]
         on_f_b = librosa.time_to_frames([t_b], sr=sr, hop_length=hop_length)
-        if librosa.util.normalize(onset_env)[on_f_b] >= prev_val:        
-            prev_val = librosa.util.normalize(onset_env)[on_f_b]
+        if norm_onset_env[on_f_b] >= prev_val:        
+            prev_val = norm_onset_env[on_f_b]
             keep_beat_start = b
             keep_beat_end = beats[i+3]
-            alert_start = i
 
-    beat_start = librosa.frames_to_samples([keep_beat_start])[0]
-    beat_end = librosa.frames_to_samples([keep_beat_end])[0]
+    beat_start = librosa.frames_to_samples([keep_beat_start], hop_length=hop_length)[0]
+    beat_end = librosa.frames_to_samples([keep_beat_end], hop_length=hop_length)[0]
+    return beat_start, beat_end
 
+def feature_extract_blues(blues_track, sr, current_timesig, onset_threshold=0.7):
+    # get rhythm overlay
+    hop_length = 512
+    blues_harm, blues_perc = pdsp.hpss(blues_track, sr, margin=(1.0, 5.0))
+    onset_env = pdsp.onset_strength(blues_perc, sr=sr,
+        aggregate=np.median)
+    _, beats = librosa.beat.beat_track(onset_envelope=onset_env,
+        sr=sr)
+    
+    beat_start, beat_end = strongest_beats(onset_env, beats, sr, hop_length)
           
     overlay_sample = blues_perc[beat_start:beat_end]
+    del blues_perc
     
     # get beat samples
     beat_samples = librosa.frames_to_samples(beats, hop_length=hop_length)
@@ -191,47 +264,43 @@ def echo_amplitude(amplitude, e_min=0.6, e_max=1.4):
         echo_curve.append( e_min + ((e_max - e_min) / (a_max - a_min)) * (val - a_min) )
     return np.array(echo_curve)
 
+# (normalized tempo, delay) curves from a frame-wise tempo estimate
+def tempo_curves(dtempo, low_proc=True, smooth_coeff=811):
+    if not low_proc:
+        tempo_curve = moving_average_filter(dtempo, smooth_coeff)
+    else:
+        tempo_curve = dtempo
+    return normalized_tempo(tempo_curve), delay(tempo_curve)
+
 # number of segments should be proportional to track length and relevant to genre
 def feature_extract_classical(classical_track, sr, low_proc=True, num_segments=10, seg_thresh=2, smooth_coeff=811):
     # SEGMENTATION
     # segments
 
-    mfcc = librosa.feature.mfcc(y=classical_track, sr=sr)
-    bounds = librosa.segment.agglomerative(mfcc, num_segments)
-    sample_bounds = librosa.frames_to_samples(bounds)
-    sample_intervals = boundaries_to_intervals(sample_bounds)
-    
-    # clean up short segments
-    del_list = []
-    for i, intr in enumerate(sample_intervals):
-        if intr[1] - intr[0] < seg_thresh * sr:
-            del_list.append(i)
-    sample_intervals = np.delete(sample_intervals, del_list, axis=0)
+    # one log-mel spectrogram feeds both the mfcc and the onset envelope
+    log_mel = pdsp.log_melspectrogram(classical_track, sr)
+    mfcc = pdsp.mfcc(S=log_mel, sr=sr)
+    sample_intervals = segment_intervals(mfcc, sr, num_segments, seg_thresh)
     
     # TEMPO CHANGE
     # tempo curve
-    onset_env = librosa.onset.onset_strength(classical_track, sr=sr)
+    onset_env = pdsp.onset_strength(S=log_mel, sr=sr)
     dtempo = librosa.beat.tempo(onset_envelope=onset_env, sr=sr,
                             aggregate=None)
 
+    normalized_tempo_curve, delay_curve = tempo_curves(dtempo, low_proc, smooth_coeff)
+
     if not low_proc:
-        tempo_curve = moving_average_filter(dtempo, smooth_coeff)
-        normalized_tempo_curve = normalized_tempo(tempo_curve)
-    
         # ECHO
-        # echo amplitude
-        lpf_amplitude = moving_average_filter(np.abs(classical_track), sr) # 1 sec - long filter
+        # echo amplitude, per hop: 1 sec filter is sr / hop frames
+        lpf_amplitude = moving_average_filter(sf.hop_abs_mean(classical_track, curves.CURVE_HOP), int(sr / curves.CURVE_HOP))
         echo_ampl_curve = echo_amplitude(lpf_amplitude)
-        
-        # delay curve
-        delay_curve = delay(tempo_curve)
+        del lpf_amplitude
     else:
-        normalized_tempo_curve = normalized_tempo(dtempo)
         echo_ampl_curve = None
-        delay_curve = delay(dtempo)
         
     # EXTRACTED SAMPLE
-    classical_harm = librosa.effects.harmonic(classical_track)
+    classical_harm = pdsp.harmonic(classical_track, sr)
     try:
         rep_samples_audio, num_seg = extract.extract_sample(classical_harm, sr, 1)
         signal_sample = rep_samples_audio[0][0]
@@ -239,8 +308,79 @@ def feature_extract_classical(classical_track, sr, low_proc=True, num_segments=1
         print "Could not extract sample from VS Pipeline, using default.."
         mdpt = int(len(classical_harm)/2)
         signal_sample = classical_harm[mdpt : mdpt + sr]
+    del classical_harm
     
-    return {'bounds':sample_intervals, 'tempo': normalized_tempo_curve, 'echo':echo_ampl_curve, 'delay': delay_curve, 'alert':signal_sample}
+    # tempo and delay are per onset frame (512 samples), echo per hop
+    return curves.pack({'bounds':sample_intervals, 'tempo': normalized_tempo_curve, 'echo':echo_ampl_curve, 'delay': delay_curve, 'alert':signal_sample,
+        'frame_hop': 512, 'echo_hop': curves.CURVE_HOP})
+
+
+########################################
+# BOUNDED-MEMORY PROCESSING FOR LONG 
+# JAZZ/ BLUES/ CLASSICAL TRACKS
+########################################
+
+# same dictionaries as the feature_extract_* functions above, from frame
+# features gathered in one streaming pass plus short re-reads of the
+# regions whose audio is kept (alert sample, blues overlay)
+def feature_extract_streaming(track_name, genre_tag, time_sig, sr=22050, block_secs=30.0, low_proc=True, smooth_coeff=811):
+    hop_length = 512
+    feats = sf.block_features(track_name, sr, genre_tag, block_secs, hop_length=hop_length)
+    trim_start = feats['trim'][0]
+    margin = (1.0, 5.0) if genre_tag == 'blues' else 1.0
+
+    # harmonic/ percussive audio of [start, stop) of the trimmed track
+    def region_component(start, stop, percussive=False):
+        y, offset = sf.read_region(track_name, sr, trim_start + start, trim_start + stop, pad=sr)
+        harm, perc = librosa.effects.hpss(y, margin=margin)
+        if percussive:
+            return perc[offset: offset + stop - start]
+        return harm[offset: offset + stop - start]
+
+    # EXTRACTED SAMPLE
+    try:
+        sample_bounds, num_seg = extract.select_samples(feats['chroma'], 1)
+        samp_left, samp_right, _ = sample_bounds[0]
+        signal_sample = region_component(samp_left, samp_right)
+    except:
+        print "Could not extract sample from VS Pipeline, using default.."
+        mdpt = int(feats['n']/2)
+        signal_sample = region_component(mdpt, mdpt + sr)
+
+    if genre_tag == 'jazz':
+        mfcc = librosa.feature.mfcc(S=feats['mel_db'], sr=sr)
+        sample_intervals = segment_intervals(mfcc, sr, 8, 3)
+
+        onset_env = librosa.onset.onset_strength(S=feats['perc_mel_db'], sr=sr, aggregate=np.median)
+        _, beats = librosa.beat.beat_track(onset_envelope=onset_env, sr=sr)
+
+        return {'bounds':sample_intervals, 'shift': [], 'alert': signal_sample, 'beats': librosa.frames_to_samples(beats)}
+
+    elif genre_tag == 'blues':
+        onset_env = librosa.onset.onset_strength(S=feats['perc_mel_db'], sr=sr, aggregate=np.median)
+        _, beats = librosa.beat.beat_track(onset_envelope=onset_env, sr=sr)
+
+        beat_start, beat_end = strongest_beats(onset_env, beats, sr, hop_length)
+        overlay_sample = region_component(beat_start, beat_end, percussive=True)
+
+        return {'overlay': overlay_sample, 'beats': librosa.frames_to_samples(beats, hop_length=hop_length), 'alert': signal_sample}
+
+    else:
+        mfcc = librosa.feature.mfcc(S=feats['mel_db'], sr=sr)
+        sample_intervals = segment_intervals(mfcc, sr, 10, 2)
+
+        onset_env = librosa.onset.onset_strength(S=feats['mel_db'], sr=sr)
+        dtempo = librosa.beat.tempo(onset_envelope=onset_env, sr=sr, aggregate=None)
+        normalized_tempo_curve, delay_curve = tempo_curves(dtempo, low_proc, smooth_coeff)
+
+        param_dict = {'bounds':sample_intervals, 'tempo': normalized_tempo_curve, 'echo': None, 'delay': delay_curve, 'alert':signal_sample}
+        if not low_proc:
+            # per hop rather than per sample: 1 sec filter is sr / hop_length frames
+            lpf_amplitude = moving_average_filter(feats['abs_mean'], int(sr / hop_length))
+            param_dict['echo'] = echo_amplitude(lpf_amplitude)
+            param_dict['echo_hop'] = hop_length
+
+        return curves.pack(param_dict)
 
 
 ########################################
@@ -258,7 +398,9 @@ def feature_extract_pop(track_name, sr, num_segments=8, num_clusters=3, seg_thre
 
     # CHANGES FOR STUDY PHASE 2
     # EXTRACTED SAMPLE
-    pop_track, _ = librosa.load(track_name)
+    # the untrimmed track, as the alert has always been cut from it
+    # (jukebox.raw_audio has its leading silence trimmed)
+    pop_track, _ = audio_io.load(track_name)
     try:
         rep_samples_audio, num_seg = extract.extract_sample(pop_track, sr, 1)
         signal_sample = rep_samples_audio[0][0]
@@ -277,7 +419,33 @@ def feature_extract_pop(track_name, sr, num_segments=8, num_clusters=3, seg_thre
         else:
             pass
 
-    return {'jukebox': jukebox, 'alert':signal_sample}
+    return {'jukebox': jukebox, 'alert':signal_sample, 'transitions': jump_transitions(jukebox, sr)}
+
+# a beat's jump candidates, best first: closest in loudness to the beat the
+# jump replaces
+def ranked_candidates(jukebox, beat):
+    replaced = jukebox.beats[beat['next']]
+    return sorted(beat['jump_candidates'], key=lambda c: abs(jukebox.beats[c]['amplitude'] - replaced['amplitude']))
+
+# crossfades from the beat a jump replaces into each of the top candidates,
+# for every beat that can jump: {'length': samples, 'heads': {(beat id,
+# candidate id): int16 crossfade}}. The jukebox plays the crossfade and then
+# the rest of the candidate beat.
+def jump_transitions(jukebox, sr, top=4, fade_secs=0.03):
+    n = int(fade_secs * sr)
+    fade_in = windows.ramp(n, 0.0, 1.0)
+    fade_out = windows.ramp(n, 1.0, 0.0)
+
+    heads = {}
+    for beat in jukebox.beats:
+        if beat['jump_candidates'] == [] or beat['next'] is None:
+            continue
+        leaving = audio_io.to_float32(jukebox.beats[beat['next']]['buffer'][:n])
+        for c in ranked_candidates(jukebox, beat)[:top]:
+            arriving = audio_io.to_float32(jukebox.beats[c]['buffer'][:n])
+            if len(leaving) == n and len(arriving) == n:
+                heads[(beat['id'], c)] = audio_io.to_int16(leaving * fade_out + arriving * fade_in)
+    return {'length': n, 'heads': heads}
 
 
 if __name__ == "__main__":
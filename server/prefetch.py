@@ -0,0 +1,190 @@
+#####################################
+# Music Signaling Pipeline Prototype
+#   Prefetch: load the next track's
+#   audio and params while the
+#   current one plays
+#
+# Author: Ishwarya Ananthabhotla
+######################################
+
+import os
+import pickle
+import threading
+
+import numpy as np
+import librosa
+
+import pre_processing as pre
+import audio_io
+import curves
+import beat_index
+
+
+ANALYSIS_SR = 22050
+
+# how a playback source is held: float32, int16 in memory (half the size),
+# or int16 memory-mapped from a cache file (paged in as it plays)
+STORAGE = ['float32', 'int16', 'memmap']
+
+
+# (n, channels) float32 frames from librosa's (channels, n) or (n,) layout
+def to_frames(y, channels):
+    if y.ndim == 1:
+        y = y[np.newaxis, :]
+    if y.shape[0] != channels:
+        y = np.tile(librosa.to_mono(y), (channels, 1))
+    return np.ascontiguousarray(y.T, dtype=np.float32)
+
+# resample an analysis-rate clip to the playback rate
+def to_playback_rate(clip, sr):
+    if sr == ANALYSIS_SR or clip is None or len(clip) == 0:
+        return clip
+    return librosa.resample(np.asarray(clip, dtype=np.float32), ANALYSIS_SR, sr, res_type=audio_io.res_type())
+
+# param dicts hold positions and clips at the analysis rate (mono, 22050);
+# rescale them to the playback source so the modifiers can use them as is
+def to_playback(param_dict, source, sr):
+    ratio = sr / float(ANALYSIS_SR)
+    out = dict(param_dict)
+
+    for key in ['beats', 'bounds']:
+        if key in out and len(out[key]) > 0:
+            out[key] = np.round(np.asarray(out[key]) * ratio).astype(int)
+    for key in ['alert', 'overlay']:
+        if key in out:
+            out[key] = to_playback_rate(out[key], sr)
+
+    # pre-rendered clips, jump crossfades and the stored stft are mono 22050;
+    # the modifiers and the jukebox render live from the playback source instead
+    out.pop('variants', None)
+    out.pop('transitions', None)
+    out.pop('stft', None)
+
+    # classical curves
+    if 'curve_hop' in out:
+        out['curve_hop'] = param_dict['curve_hop'] * ratio
+
+    # beat buffers come straight from the playback source
+    if 'jukebox' in out:
+        jukebox = out['jukebox']
+        for b in jukebox.beats:
+            b['buffer'] = source[int(b['start'] * sr): int((b['start'] + b['duration']) * sr)]
+        jukebox.sample_rate = sr
+
+    return out
+
+
+class Track_Prefetcher():
+    # sr/ channels: playback format; analysis always ran on mono 22050
+    def __init__(self, track_names, genre_tags, time_sigs, sr=ANALYSIS_SR, channels=1, storage='float32',
+            artifact_path='preprocess_data/', source_file_path='tracks/', cache_path='preprocess_data/playback/'):
+        self.track_names = track_names
+        self.genre_tags = genre_tags
+        self.time_sigs = time_sigs
+        self.sr = sr
+        self.channels = channels
+        self.storage = storage
+        self.cache_path = cache_path
+        self.artifact_path = artifact_path
+        self.source_file_path = source_file_path
+        # param dicts by track index from an old prep.dat, used for tracks
+        # without an artifact in artifact_path
+        self.legacy = None
+
+        # track index -> (audio, param_dict) / threading.Event
+        self.loaded = {}
+        self.ready = {}
+        self.lock = threading.Lock()
+
+    # start loading track i on a daemon thread, unless it is already under way
+    def prefetch(self, i):
+        if i >= len(self.track_names):
+            return
+        with self.lock:
+            if i in self.ready:
+                return
+            self.ready[i] = threading.Event()
+
+        t = threading.Thread(target=self.load, args=(i, ))
+        t.daemon = True
+        t.start()
+
+    def artifact_path_of(self, i):
+        return self.artifact_path + pre.artifact_name(self.track_names[i], self.genre_tags[i], self.time_sigs[i], self.source_file_path)
+
+    # names of the tracks that have no artifact in artifact_path
+    def missing(self):
+        return [self.track_names[i] for i in range(len(self.track_names)) if not os.path.exists(self.artifact_path_of(i))]
+
+    def load(self, i):
+        try:
+            path = self.artifact_path_of(i)
+            if not os.path.exists(path) and self.legacy is not None:
+                param_dict = curves.pack(self.legacy[i])
+            else:
+                param_dict = curves.pack(pickle.load(open(path, 'rb')))
+
+            audio = self.cached(i)
+            if audio is None:
+                audio = self.decode(i)
+                if self.storage == 'int16':
+                    audio = audio_io.to_int16(audio)
+                elif self.storage == 'memmap':
+                    audio = self.cache(i, audio)
+
+            if self.sr != ANALYSIS_SR or self.channels != 1:
+                param_dict = to_playback(param_dict, audio, self.sr)
+            # in playback samples, so after to_playback
+            param_dict['index'] = beat_index.build(param_dict, self.time_sigs[i])
+
+            self.loaded[i] = (audio, param_dict)
+        except Exception as e:
+            print "Could not load track ", self.track_names[i], ": ", e
+            self.loaded[i] = None
+        finally:
+            self.ready[i].set()
+
+    # trimmed float32 playback source
+    def decode(self, i):
+        if self.sr == ANALYSIS_SR and self.channels == 1:
+            audio, _ = audio_io.load(self.track_names[i], sr=self.sr)
+            audio, _ = librosa.effects.trim(audio)
+            return audio
+
+        audio, _ = audio_io.load(self.track_names[i], sr=self.sr, mono=False)
+        # same trim frames as at the analysis rate
+        ratio = self.sr / float(ANALYSIS_SR)
+        audio, _ = librosa.effects.trim(audio, frame_length=int(2048 * ratio), hop_length=int(512 * ratio))
+        return to_frames(audio, self.channels)
+
+    # int16 cache file for track i in the playback format (and resampler)
+    def cache_name(self, i):
+        name = self.track_names[i].replace(self.source_file_path, '')
+        return self.cache_path + "%s_%d_%d_%s.int16" % (name, self.sr, self.channels, audio_io.resample_quality)
+
+    # memory-mapped source from an earlier run, None if there is none
+    def cached(self, i):
+        path = self.cache_name(i)
+        if self.storage != 'memmap' or not os.path.exists(path):
+            return None
+        n = os.path.getsize(path) // (2 * self.channels)
+        return np.memmap(path, dtype=np.int16, mode='r', shape=(n,) if self.channels == 1 else (n, self.channels))
+
+    def cache(self, i, audio):
+        if not os.path.exists(self.cache_path):
+            os.makedirs(self.cache_path)
+        path = self.cache_name(i)
+
+        # write next to the cache file and swap in, like the library index
+        tmp_path = path + '.tmp'
+        audio_io.to_int16(audio).tofile(tmp_path)
+        os.rename(tmp_path, path)
+        return self.cached(i)
+
+    # block until track i is in memory and hand it over; None if it failed to load
+    def get(self, i):
+        self.prefetch(i)
+        self.ready[i].wait()
+        with self.lock:
+            del self.ready[i]
+        return self.loaded.pop(i)
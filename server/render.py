@@ -0,0 +1,355 @@
+#####################################
+# Music Signaling Pipeline Prototype
+#   Render: produce playback audio a
+#   bounded distance ahead of the
+#   device, applying edits on the way
+#
+# Author: Ishwarya Ananthabhotla
+######################################
+
+# A queued track (its source) is never written to. Modifiers describe what
+# they want as edits in source sample coordinates:
+#   'add':     mix data into [start, stop)
+#   'replace': overwrite [start, stop) with data
+#   'gain':    multiply [start, stop) by data (an array or a scalar)
+#   'splice':  play data instead of [start, stop); data may be any length,
+#              so everything after it moves
+# The render thread copies the source block by block, applies the edits that
+# overlap each block and writes the result into a ring buffer that the audio
+# callback drains. An edit is only accepted while the renderer has not yet
+# reached its start, so nothing is changed after it has been rendered and the
+# device never sees a half-applied edit. Runs that have audio mixed into
+# them go through a soft limiter, so overlays never clip.
+#
+# Sources are (n,) mono or (n, channels) frames, float32 or int16 (converted
+# only as each block is rendered); edit data may be mono either way and is
+# then applied to every channel.
+#
+# A source may also be a stream: an object with the track's audio in .audio
+# and a next_run() method giving the next (run of audio, source position it
+# stands for), or None at the end of the track. The renderer calls it only
+# when it needs more audio, with its lock held, so next_run() must not call
+# back into the renderer. Edits are not applied to streams.
+#
+# The ring has one writer (the render thread) and one reader (the callback);
+# each only moves its own position, so neither side takes a lock.
+
+import collections
+import threading
+import time
+
+import numpy as np
+
+import audio_io
+import loudness
+
+
+class Ring_Buffer():
+    def __init__(self, capacity, channels=1):
+        self.data = np.zeros(capacity if channels == 1 else (capacity, channels), dtype=np.float32)
+        self.capacity = capacity
+        # samples ever written/ read
+        self.write_pos = 0L
+        self.read_pos = 0L
+
+    def readable(self):
+        return self.write_pos - self.read_pos
+
+    def writable(self):
+        return self.capacity - self.readable()
+
+    # caller makes sure len(block) <= writable()
+    def write(self, block):
+        n = len(block)
+        i = self.write_pos % self.capacity
+        k = min(n, self.capacity - i)
+        self.data[i: i + k] = block[:k]
+        self.data[:n - k] = block[k:]
+        self.write_pos += n
+
+    # copy up to len(out) samples into out, returns how many
+    def read_into(self, out):
+        n = min(len(out), self.readable())
+        i = self.read_pos % self.capacity
+        k = min(n, self.capacity - i)
+        out[:k] = self.data[i: i + k]
+        out[k:n] = self.data[:n - k]
+        self.read_pos += n
+        return n
+
+
+# apply one edit to seg, which holds source samples [seg_start, seg_start + len(seg))
+def apply_edit(seg, seg_start, edit):
+    lo = max(seg_start, edit['start'])
+    hi = min(seg_start + len(seg), edit['stop'])
+    if lo >= hi:
+        return
+
+    target = seg[lo - seg_start: hi - seg_start]
+    data = edit['data']
+    if not np.isscalar(data):
+        data = data[lo - edit['start']: hi - edit['start']]
+        if data.ndim < target.ndim:
+            data = data[:, np.newaxis]
+        if data.dtype == np.int16:
+            data = audio_io.to_float32(data)
+
+    if edit['kind'] == 'add':
+        target += data
+    elif edit['kind'] == 'replace':
+        target[:] = data
+    elif edit['kind'] == 'gain':
+        target *= data
+
+
+class Renderer():
+    def __init__(self, sr=22050, block_size=1024, ahead_secs=1.0, channels=1):
+        self.sr = sr
+        self.block_size = block_size
+        self.ring = Ring_Buffer(max(2 * block_size, int(ahead_secs * sr)), channels)
+        self.block = np.zeros(block_size if channels == 1 else (block_size, channels), dtype=np.float32)
+
+        # (source, song index) waiting to be rendered, oldest first
+        self.queued = collections.deque()
+        self.source = None
+        self.song = None
+        # next source sample to render
+        self.src_pos = 0L
+        # (data, samples of it rendered, source position it stands in for)
+        self.pending_splice = None
+        # the current source's stream, if it is one, and its current run (as pending_splice)
+        self.stream = None
+        self.stream_run = None
+
+        self.edits = []
+        self.lock = threading.Lock()
+
+        # (ring position, song index, source, source position, advancing) for
+        # every run of rendered audio; the callback drops the ones it has played
+        self.marks = collections.deque()
+
+        self.running = False
+        self.finishing = False
+        self.exhausted = False
+        self.late_edits = 0
+        self.underruns = 0
+
+    ###################################
+    # CONTROL
+    ###################################
+
+    def queue(self, source, song):
+        with self.lock:
+            self.queued.append((source, song))
+
+    # no more tracks will be queued; once everything is rendered, exhausted is set
+    def finish(self):
+        self.finishing = True
+
+    def start(self):
+        self.running = True
+        t = threading.Thread(target=self.run)
+        t.daemon = True
+        t.start()
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+        wait = self.block_size / float(self.sr) / 4.0
+        while self.running:
+            if self.exhausted or self.ring.writable() < self.block_size:
+                time.sleep(wait)
+            elif self.render_block() == 0:
+                if self.finishing:
+                    self.exhausted = True
+                else:
+                    # the next track is still loading
+                    time.sleep(wait)
+
+    ###################################
+    # EDITS
+    ###################################
+
+    # first source sample of song that can still be edited, None once the
+    # renderer has moved past the song
+    def editable_from(self, song):
+        with self.lock:
+            if song == self.song:
+                return self.src_pos
+            if any(s == song for _, s in self.queued):
+                return 0L
+        return None
+
+    # False if the renderer has already passed start
+    def submit(self, kind, song, start, stop, data):
+        with self.lock:
+            if song == self.song:
+                late = start < self.src_pos
+            else:
+                late = not any(s == song for _, s in self.queued)
+            if late:
+                self.late_edits += 1
+                return False
+            self.edits.append({'kind': kind, 'song': song, 'start': long(start), 'stop': long(stop), 'data': data})
+        return True
+
+    def add(self, song, start, data):
+        return self.submit('add', song, start, start + len(data), data)
+
+    def replace(self, song, start, data):
+        return self.submit('replace', song, start, start + len(data), data)
+
+    def gain(self, song, start, stop, data):
+        return self.submit('gain', song, start, stop, data)
+
+    def splice(self, song, start, stop, data):
+        return self.submit('splice', song, start, stop, data)
+
+    # drop edits the renderer is done with (called with the lock held)
+    def prune(self):
+        songs = [self.song] + [s for _, s in self.queued]
+        self.edits = [e for e in self.edits if e['song'] in songs and
+            (e['song'] != self.song or e['start'] >= self.src_pos or (e['kind'] != 'splice' and e['stop'] > self.src_pos))]
+
+    ###################################
+    # RENDERING
+    ###################################
+
+    # claim the next run of at most n samples that plays straight through;
+    # (buf, offset, n, song, source, source position, advancing, edits)
+    # or None when there is nothing to render
+    def claim(self, n):
+        with self.lock:
+            while True:
+                if self.pending_splice is not None:
+                    data, k, at = self.pending_splice
+                    if k >= len(data):
+                        self.pending_splice = None
+                        continue
+                    n = min(n, len(data) - k)
+                    self.pending_splice = (data, k + n, at)
+                    return data, k, n, self.song, self.source, at, False, []
+
+                if self.stream is not None:
+                    if self.stream_run is None or self.stream_run[1] >= len(self.stream_run[0]):
+                        run = self.stream.next_run()
+                        if run is None:
+                            self.stream = None
+                            self.source = None
+                            continue
+                        self.stream_run = (run[0], 0, run[1])
+                    data, k, at = self.stream_run
+                    n = min(n, len(data) - k)
+                    self.stream_run = (data, k + n, at)
+                    self.src_pos = at + k + n
+                    return data, k, n, self.song, self.source, at + k, True, []
+
+                if self.source is None or self.src_pos >= len(self.source):
+                    if len(self.queued) == 0:
+                        return None
+                    self.source, self.song = self.queued.popleft()
+                    self.src_pos = 0L
+                    if hasattr(self.source, 'next_run'):
+                        self.stream = self.source
+                        self.source = self.stream.audio
+                        self.stream_run = None
+                    continue
+
+                start = self.src_pos
+                stop = min(start + n, len(self.source))
+
+                splices = [e for e in self.edits if e['kind'] == 'splice' and e['song'] == self.song and start <= e['start'] < stop]
+                if splices != []:
+                    first = min(splices, key=lambda e: e['start'])
+                    if first['start'] == start:
+                        self.edits.remove(first)
+                        self.pending_splice = (first['data'], 0, start)
+                        self.src_pos = max(start, first['stop'])
+                        continue
+                    stop = first['start']
+
+                edits = [e for e in self.edits if e['kind'] != 'splice' and e['song'] == self.song and e['start'] < stop and e['stop'] > start]
+                self.src_pos = stop
+                return self.source, start, stop - start, self.song, self.source, start, True, edits
+
+    # render up to one block into the ring, returns the number of samples
+    def render_block(self):
+        out = self.block
+        filled = 0
+
+        with self.lock:
+            self.prune()
+
+        while filled < len(out):
+            claimed = self.claim(len(out) - filled)
+            if claimed is None:
+                break
+            buf, offset, n, song, source, src, advancing, edits = claimed
+
+            seg = out[filled: filled + n]
+            run = buf[offset: offset + n]
+            if run.ndim < seg.ndim:
+                run = run[:, np.newaxis]
+            if run.dtype == np.int16:
+                np.multiply(run, audio_io.INT16_SCALE, out=seg)
+            else:
+                seg[:] = run
+            for e in edits:
+                apply_edit(seg, src, e)
+            if any(e['kind'] == 'add' for e in edits):
+                loudness.soft_limit(seg, out=seg)
+
+            self.marks.append((self.ring.write_pos + filled, song, source, src, advancing))
+            filled += n
+
+        if filled > 0:
+            self.ring.write(out[:filled])
+        return filled
+
+    # offline use, without the render thread: render until n samples are ready.
+    # False if that has to wait for a track that is still loading
+    def fill(self, n):
+        while self.ring.readable() < n and not self.exhausted:
+            if self.render_block() == 0:
+                if not self.finishing:
+                    return False
+                self.exhausted = True
+        return True
+
+    ###################################
+    # PLAYBACK SIDE
+    ###################################
+
+    # called from the audio callback: fill out from the ring, returns how many
+    # samples were available
+    def read(self, out):
+        n = self.ring.read_into(out)
+        if n < len(out) and self.ring.write_pos > 0 and not self.exhausted:
+            self.underruns += 1
+        return n
+
+    # output samples the device gets before the editable point: what is
+    # rendered and not read yet, plus the rest of a splice being played
+    def ahead_of_editable(self):
+        with self.lock:
+            ahead = self.ring.readable()
+            if self.pending_splice is not None:
+                data, k, _ = self.pending_splice
+                ahead += len(data) - k
+        return ahead
+
+    # (song index, source, source position) of the next sample the device
+    # will get, or None before anything has been rendered
+    def now_playing(self):
+        pos = self.ring.read_pos
+        marks = self.marks
+        while len(marks) > 1 and marks[1][0] <= pos:
+            marks.popleft()
+        if len(marks) == 0 or marks[0][0] > pos:
+            return None
+
+        ring_pos, song, source, src, advancing = marks[0]
+        if advancing:
+            src += pos - ring_pos
+        return song, source, src
@@ -0,0 +1,124 @@
+#####################################
+# Music Signaling Pipeline Prototype
+#   Scheduler: hold signals until a
+#   modifier can take them
+#
+# Author: Ishwarya Ananthabhotla
+######################################
+
+# Signals are never dropped for arriving at a bad moment (a modifier still
+# running, a song loading, too little of the song left, a renderer that got
+# past the edit first). They wait here:
+#   bursts:    a signal within burst_secs of the first of the last pending
+#              one merges into it, and so does any signal arriving while the
+#              rate limit holds that one back; the merged level is the
+#              highest of its signals, one level higher for every
+#              escalate_every signals (so ten emails at once become one more
+#              obvious signal)
+#   priority:  the highest level goes first, then the oldest
+#   rate:      at most one dispatch every min_gap_secs, however many arrive;
+#              a flood becomes one signal every min_gap_secs
+#   retries:   a signal the renderer refused as late goes again straight
+#              away, without counting against the rate limit; one that found
+#              no room left in its song waits for the next one
+#   expiry:    only signals that have had nothing merged into them for
+#              max_age_secs are given up
+# Times come from clock(): the wall clock for a live client, the playback
+# clock for scripted runs, so those stay the same from run to run.
+
+import threading
+import time
+
+import global_settings as gs
+
+MAX_LEVEL = 2
+
+
+class Signal_Scheduler():
+    def __init__(self, burst_secs=0.5, min_gap_secs=4.0, escalate_every=5, max_age_secs=60.0, clock=time.time):
+        self.burst_secs = burst_secs
+        self.min_gap_secs = min_gap_secs
+        self.escalate_every = escalate_every
+        self.max_age_secs = max_age_secs
+        self.clock = clock
+
+        # {'level', 'levels', 'sig', 'first', 'last', 'after_song'}, arrival order
+        self.pending = []
+        self.lock = threading.Lock()
+        self.last_dispatch = None
+        # the dispatch before last_dispatch, restored when that one is retried as late
+        self.previous_dispatch = None
+
+        self.dispatched = 0
+        self.merged = 0
+        self.retried = 0
+        self.expired = 0
+
+    # sig is the latency record; merged signals are counted as 'merged' there
+    def add(self, level, sig=None):
+        now = self.clock()
+        with self.lock:
+            if self.pending != []:
+                last = self.pending[-1]
+                if last['after_song'] is None and (now - last['first'] <= self.burst_secs or self.held(now)):
+                    last['levels'].append(level)
+                    last['last'] = now
+                    last['level'] = min(MAX_LEVEL, max(last['levels']) + (len(last['levels']) - 1) // self.escalate_every)
+                    self.merged += 1
+                    gs.latency.dropped(sig, 'merged')
+                    return
+            self.pending.append({'level': level, 'levels': [level], 'sig': sig, 'first': now, 'last': now, 'after_song': None})
+
+    # the rate limit is holding dispatches back at now
+    def held(self, now):
+        return self.last_dispatch is not None and now - self.last_dispatch < self.min_gap_secs
+
+    # clock time the next signal could go, None when nothing is pending
+    def ready_at(self):
+        with self.lock:
+            if self.pending == []:
+                return None
+            t = min(e['first'] + self.burst_secs for e in self.pending)
+            if self.last_dispatch is not None:
+                t = max(t, self.last_dispatch + self.min_gap_secs)
+            return t
+
+    # the signal to hand to a modifier now, for song, removed from pending;
+    # None if nothing can go yet
+    def next(self, song):
+        now = self.clock()
+        with self.lock:
+            self.expire(now)
+            if self.held(now):
+                return None
+
+            ready = [e for e in self.pending if now - e['first'] >= self.burst_secs and e['after_song'] != song]
+            if ready == []:
+                return None
+            entry = max(ready, key=lambda e: (e['level'], -e['first']))
+            self.pending.remove(entry)
+            self.previous_dispatch, self.last_dispatch = self.last_dispatch, now
+            self.dispatched += 1
+            return entry
+
+    # entry found no room in song: keep it for the next one. Without a song,
+    # entry was refused as late: it may go again as soon as a modifier is free
+    def retry(self, entry, song=None):
+        with self.lock:
+            if song is not None:
+                entry['after_song'] = song
+            else:
+                self.last_dispatch = self.previous_dispatch
+            self.pending.append(entry)
+            self.retried += 1
+
+    # called with the lock held
+    def expire(self, now):
+        for e in [e for e in self.pending if now - e['last'] > self.max_age_secs]:
+            self.pending.remove(e)
+            self.expired += 1
+            gs.latency.dropped(e['sig'], 'expired')
+
+    def report(self):
+        print "Scheduled signals: %d dispatched, %d merged, %d retried, %d expired, %d still pending" % (
+            self.dispatched, self.merged, self.retried, self.expired, len(self.pending))
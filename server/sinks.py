@@ -0,0 +1,142 @@
+#####################################
+# Music Signaling Pipeline Prototype
+#   Sinks: where rendered audio goes
+#   (sound card, WAV file, nowhere)
+#
+# Author: Ishwarya Ananthabhotla
+######################################
+
+# Every sink is opened with pull(frame_count) -> (float32 block of frames, more),
+# and counts the frames it has taken in frames. The PyAudio sink pulls from
+# the device callback, in realtime. The offline sinks pull on their own
+# thread as fast as pull returns, so a playlist renders faster than realtime;
+# hold(n) stops them at frame n (at a block boundary) until it is moved on,
+# which lets scripted signals land at exactly the same point every run.
+
+import threading
+import time
+import wave
+
+import numpy as np
+
+import audio_io
+
+try:
+    import pyaudio
+except ImportError:
+    pyaudio = None
+
+SINKS = ['pyaudio', 'wav', 'null']
+
+
+class PyAudio_Sink():
+    realtime = True
+
+    def __init__(self):
+        self.frames = 0L
+
+    def open(self, sr, block_size, pull, channels=1):
+        def callback(in_data, frame_count, time_info, status):
+            out, more = pull(frame_count)
+            self.frames += frame_count
+            return (out, pyaudio.paContinue if more else pyaudio.paComplete)
+
+        self.p = pyaudio.PyAudio()
+        self.stream = self.p.open(format=pyaudio.paFloat32,
+                                  channels=channels,
+                                  rate=sr,
+                                  output=True,
+                                  frames_per_buffer=block_size,
+                                  stream_callback=callback)
+
+    # secs from handing a block to the device to hearing it
+    def latency(self):
+        return self.stream.get_output_latency()
+
+    # the device clock can't be held
+    def hold(self, n):
+        return
+
+    def close(self):
+        self.stream.stop_stream()
+        self.stream.close()
+        self.p.terminate()
+
+
+class Null_Sink():
+    realtime = False
+
+    def __init__(self):
+        self.frames = 0L
+        self.limit = None
+        self.running = False
+        self.wall_secs = 0.0
+
+    def open(self, sr, block_size, pull, channels=1):
+        self.sr = sr
+        self.block_size = block_size
+        self.running = True
+        self.thread = threading.Thread(target=self.run, args=(pull, ))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self, pull):
+        start_time = time.time()
+        while self.running:
+            if self.limit is not None and self.frames >= self.limit:
+                time.sleep(0.001)
+                continue
+            out, more = pull(self.block_size)
+            self.write(out)
+            self.frames += len(out)
+            if not more:
+                break
+        self.wall_secs = time.time() - start_time
+
+    def latency(self):
+        return 0.0
+
+    def hold(self, n):
+        self.limit = n
+
+    def write(self, out):
+        return
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        secs = self.frames / float(self.sr)
+        print "Rendered %.1fs of audio in %.2fs, %.0fx realtime" % (secs, self.wall_secs, secs / max(self.wall_secs, 1e-6))
+
+
+class Wav_Sink(Null_Sink):
+    def __init__(self, path='render.wav'):
+        Null_Sink.__init__(self)
+        self.path = path
+
+    def open(self, sr, block_size, pull, channels=1):
+        self.wav = wave.open(self.path, 'wb')
+        self.wav.setnchannels(channels)
+        self.wav.setsampwidth(2)
+        self.wav.setframerate(sr)
+        Null_Sink.open(self, sr, block_size, pull, channels)
+
+    def write(self, out):
+        self.wav.writeframes(audio_io.to_int16(out).tostring())
+
+    def close(self):
+        Null_Sink.close(self)
+        self.wav.close()
+        print "Wrote", self.path
+
+
+def make_sink(name, path='render.wav'):
+    if name == 'pyaudio':
+        if pyaudio is None:
+            raise ImportError("pyaudio is needed to play to the sound card; use -sink wav or -sink null")
+        return PyAudio_Sink()
+    elif name == 'wav':
+        return Wav_Sink(path)
+    elif name == 'null':
+        return Null_Sink()
+    raise NotImplementedError
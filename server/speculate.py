@@ -0,0 +1,150 @@
+#####################################
+# Music Signaling Pipeline Prototype
+#   Speculate: render modifier clips
+#   for the next few candidate
+#   positions before any signal asks
+#
+# Author: Ishwarya Ananthabhotla
+######################################
+
+# A background worker follows gs.song_index and the renderer. It renders the
+# level 0/1 clip of the current genre at each grid position in the next
+# horizon_secs of editable audio (jazz and blues on beats, classical every
+# spacing_secs), nearest first, one clip at a time, pausing between clips so
+# the render thread keeps the CPU it needs. Clips the renderer has moved
+# past are evicted, and a new song empties the cache. A modifier that finds
+# a clip between the renderer's editable point and one grid step past its
+# start takes the earliest, so it only has to copy.
+# Positions with a pre-rendered variant in the artifact are skipped.
+
+import threading
+import time
+
+import numpy as np
+
+import global_settings as gs
+import modify_buffer as mb
+import variants
+
+LEVELS = {'jazz': [0, 1], 'classical': [0, 1], 'blues': [0, 1]}
+
+
+class Speculator():
+    def __init__(self, param_dict_list, genre_tags, time_sigs, horizon_secs=12.0, spacing_secs=4.0, dur=4, pause_secs=0.05):
+        self.param_dict_list = param_dict_list
+        self.genre_tags = genre_tags
+        self.time_sigs = time_sigs
+        self.horizon_secs = horizon_secs
+        self.spacing_secs = spacing_secs
+        self.dur = dur
+        self.pause_secs = pause_secs
+
+        # the song being followed, its grid of candidate positions and
+        # level -> {position: (sample to edit at, stop, clip)}
+        self.song = None
+        self.source = None
+        self.grid = np.zeros(0, dtype=int)
+        self.clips = {}
+        self.lock = threading.Lock()
+
+        self.running = False
+        self.rendered = 0
+        self.evicted = 0
+        self.hits = 0
+        self.misses = 0
+
+    def start(self):
+        self.running = True
+        t = threading.Thread(target=self.run)
+        t.daemon = True
+        t.start()
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+        while self.running:
+            job = self.next_job()
+            if job is None:
+                time.sleep(4 * self.pause_secs)
+                continue
+
+            song, level, position = job
+            made = mb.render_ahead(self.genre_tags[song], level, self.param_dict_list[song], self.source,
+                position, self.time_sigs[song], gs.sr, self.dur)
+            with self.lock:
+                if song == self.song:
+                    self.clips[level][position] = made
+                    self.rendered += 1
+            time.sleep(self.pause_secs)
+
+    ###################################
+    # CACHE
+    ###################################
+
+    # start following song: new grid, empty cache
+    def follow(self, song, source):
+        genre = self.genre_tags[song]
+        param_dict = self.param_dict_list[song]
+        spacing = int(self.spacing_secs * gs.sr)
+
+        if genre not in LEVELS:
+            grid = np.zeros(0, dtype=int)
+        elif genre == 'classical':
+            grid = np.arange(0, len(source), spacing)
+        else:
+            grid = variants.grid(param_dict['beats'], spacing)
+
+        with self.lock:
+            self.song = song
+            self.source = source
+            self.grid = grid
+            self.clips = dict((level, {}) for level in LEVELS.get(genre, []))
+
+    # (song, level, position) of the nearest clip still missing, None if the
+    # horizon is covered; evicts what the renderer has passed on the way
+    def next_job(self):
+        song = gs.song_index
+        source = gs.audio_buffer
+        if song is None or gs.renderer is None or self.param_dict_list[song] is None:
+            return None
+        if song != self.song:
+            self.follow(song, source)
+
+        editable = gs.renderer.editable_from(song)
+        if editable is None:
+            return None
+
+        with self.lock:
+            for level in self.clips:
+                for position in [p for p in self.clips[level] if p < editable]:
+                    del self.clips[level][position]
+                    self.evicted += 1
+
+            param_dict = self.param_dict_list[song]
+            lo, hi = np.searchsorted(self.grid, [editable, editable + int(self.horizon_secs * gs.sr)])
+            for position in self.grid[lo:hi]:
+                for level in sorted(self.clips):
+                    if position in self.clips[level] or variants.lookup(param_dict, level, position) is not None:
+                        continue
+                    return song, level, position
+        return None
+
+    # (sample to edit at, stop, clip) of the first clip at or after earliest
+    # (start if not given) and within one grid step after start, removed
+    # from the cache; None on a miss
+    def take(self, song, level, start, earliest=None):
+        spacing = int(self.spacing_secs * gs.sr)
+        lo = start if earliest is None else earliest
+        with self.lock:
+            if song != self.song or level not in self.clips:
+                return None
+            ready = [p for p, made in self.clips[level].items() if made is not None and lo <= p <= start + spacing]
+            if ready == []:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return self.clips[level].pop(min(ready))
+
+    def report(self):
+        print "Speculative clips: %d rendered, %d hits, %d misses, %d evicted" % (self.rendered, self.hits, self.misses, self.evicted)
@@ -0,0 +1,159 @@
+#####################################
+# Music Signaling Pipeline Prototype
+#   Stream Features: block-streaming
+#   analysis that never holds the
+#   whole decoded track
+#
+# Author: Ishwarya Ananthabhotla
+######################################
+
+# The track is decoded and resampled chunk by chunk and cut into hop-aligned
+# analysis blocks with pad_frames of context on each side. Only frame-level
+# features (rms, log-mel, chroma) of each block's core are kept; the block
+# audio, its HPSS components and STFTs are dropped before the next block is
+# read, so peak memory follows block_secs rather than track length.
+#
+# Differences from the single-pass path in pre_processing:
+#   - the leading/ trailing silence trim is applied to the frame features
+#     after the pass, so frames next to the trim points see real audio
+#     instead of reflection padding
+#   - chroma tuning is estimated on the first block and reused
+#   - the harmonic amplitude for echo curves is a per-hop mean of |x|
+
+import numpy as np
+import librosa
+
+import audio_io
+
+
+# (block, start, core_start, core_stop, is_final) with block = y[start:stop];
+# starts and core bounds are multiples of hop_length
+def analysis_blocks(chunks, block_frames, pad_frames, hop_length=512):
+    step = block_frames * hop_length
+    pad = pad_frames * hop_length
+
+    buf = np.zeros(0, dtype=np.float32)
+    buf_start = 0
+    core_start = 0
+    pending = []
+    pending_len = 0
+
+    for chunk in chunks:
+        pending.append(chunk)
+        pending_len += len(chunk)
+        if buf_start + len(buf) + pending_len < core_start + step + pad:
+            continue
+
+        buf = np.concatenate([buf] + pending)
+        pending = []
+        pending_len = 0
+
+        while buf_start + len(buf) >= core_start + step + pad:
+            start = max(0, core_start - pad)
+            yield buf[start - buf_start: core_start + step + pad - buf_start], start, core_start, core_start + step, False
+            core_start += step
+
+            drop = max(0, core_start - pad) - buf_start
+            buf = buf[drop:]
+            buf_start += drop
+
+    buf = np.concatenate([buf] + pending)
+    n = buf_start + len(buf)
+    while core_start < n:
+        start = max(0, core_start - pad)
+        core_stop = min(n, core_start + step)
+        yield buf[start - buf_start: min(n, core_stop + pad) - buf_start], start, core_start, core_stop, core_stop == n
+        core_start = core_stop
+
+
+# per-hop mean of |x| over a core segment
+def hop_abs_mean(core, hop_length):
+    k = len(core) // hop_length
+    out = np.abs(core[:k * hop_length]).reshape((k, hop_length)).mean(axis=1)
+    if len(core) > k * hop_length:
+        out = np.append(out, np.mean(np.abs(core[k * hop_length:])))
+    return out
+
+
+# one pass over the track; frame features are cropped to the trimmed signal
+#   'n':          trimmed length in samples
+#   'trim':       (start, stop) of the trimmed signal in the decoded stream
+#   'mel_db':     log-mel of the track         (jazz, classical)
+#   'perc_mel_db':log-mel of the percussive part (jazz, blues)
+#   'chroma':     chroma of the harmonic part
+#   'abs_mean':   per-hop mean |x|             (classical)
+def block_features(track_name, sr, genre_tag, block_secs=30.0, pad_frames=32, hop_length=512, top_db=60):
+    margin = (1.0, 5.0) if genre_tag == 'blues' else 1.0
+
+    rms = []
+    mel_db = []
+    perc_mel_db = []
+    chroma = []
+    abs_mean = []
+    tuning = None
+    n = 0
+
+    block_frames = int(block_secs * sr / hop_length)
+    for block, start, core_start, core_stop, is_final in analysis_blocks(audio_io.stream(track_name, sr), block_frames, pad_frames, hop_length):
+        f0 = (core_start - start) // hop_length
+        f1 = (core_stop - start) // hop_length + (1 if is_final else 0)
+
+        rms.append(librosa.feature.rmse(y=block, frame_length=2048, hop_length=hop_length)[:, f0:f1])
+
+        if genre_tag in ['jazz', 'classical']:
+            mel = librosa.feature.melspectrogram(y=block, sr=sr, hop_length=hop_length)
+            mel_db.append(librosa.power_to_db(mel, top_db=None)[:, f0:f1])
+
+        if genre_tag in ['jazz', 'blues']:
+            harm, perc = librosa.effects.hpss(block, margin=margin)
+            mel = librosa.feature.melspectrogram(y=perc, sr=sr, hop_length=hop_length)
+            perc_mel_db.append(librosa.power_to_db(mel, top_db=None)[:, f0:f1])
+            del perc
+        else:
+            harm = librosa.effects.harmonic(block)
+
+        if tuning is None:
+            tuning = librosa.estimate_tuning(y=harm, sr=sr)
+        chroma.append(librosa.feature.chroma_stft(y=harm, sr=sr, n_fft=2048, hop_length=hop_length, tuning=tuning)[:, f0:f1])
+
+        if genre_tag == 'classical':
+            abs_mean.append(hop_abs_mean(block[core_start - start: core_stop - start], hop_length))
+
+        del block, harm, mel
+        n = core_stop
+
+    # leading/ trailing silence, as librosa.effects.trim decides it
+    mse = np.hstack(rms)[0] ** 2
+    non_silent = np.flatnonzero(librosa.power_to_db(mse, ref=np.max(mse), top_db=None) > -top_db)
+    if len(non_silent) == 0:
+        first, last = 0, 0
+    else:
+        first, last = non_silent[0], non_silent[-1] + 1
+    trim_start = first * hop_length
+    trim_stop = min(n, last * hop_length)
+    n_frames = 1 + (trim_stop - trim_start) // hop_length
+
+    def crop(frames, clip_db=None):
+        if frames == []:
+            return None
+        out = np.hstack(frames)[:, first: first + n_frames]
+        if clip_db is not None:
+            # top_db clip of power_to_db, against the trimmed track's peak
+            out = np.maximum(out, out.max() - clip_db)
+        return out
+
+    features = {'n': trim_stop - trim_start, 'trim': (trim_start, trim_stop), 'tuning': tuning,
+        'mel_db': crop(mel_db, 80.0), 'perc_mel_db': crop(perc_mel_db, 80.0), 'chroma': crop(chroma), 'abs_mean': None}
+
+    if abs_mean != []:
+        features['abs_mean'] = np.concatenate(abs_mean)[first: first + n_frames]
+
+    return features
+
+
+# decode [start, stop) of the stream with pad samples of context;
+# returns (audio, offset of start within it)
+def read_region(track_name, sr, start, stop, pad):
+    region_start = max(0, start - pad)
+    y, _ = audio_io.load(track_name, sr=sr, offset=region_start / float(sr), duration=(stop + pad - region_start) / float(sr))
+    return y, start - region_start
@@ -0,0 +1,68 @@
+#####################################
+# Music Signaling Pipeline Prototype
+#   Variants: modifier clips rendered
+#   ahead of the signal that uses them
+#
+# Author: Ishwarya Ananthabhotla
+######################################
+
+# param_dict['variants'] maps a modification level to a table of clips that
+# were pre-rendered at a grid of candidate positions:
+#   'positions': source sample each clip is edited in at (sorted)
+#   'stops':     end of the source region each clip stands in for
+#   'clips':     the clips themselves, int16
+#   'spacing':   samples between grid positions
+# A modifier takes the first clip the renderer can still edit, as long as it
+# is no more than one grid step past the signal's start, so the DSP is
+# already done and the edit is a copy. A clip can land before start (start
+# leaves room for DSP a clip doesn't need), or up to one grid step after it,
+# later than a live render would. Tables are built on the mono analysis audio, so they are
+# only used when playback is mono 22050 as well.
+
+import numpy as np
+
+import audio_io
+
+SPACING_SECS = 8.0
+
+
+# candidate positions at least spacing samples apart, taken from beats
+def grid(beats, spacing):
+    chosen = []
+    for b in beats:
+        if chosen == [] or b - chosen[-1] >= spacing:
+            chosen.append(b)
+    return np.array(chosen, dtype=int)
+
+# make(position) -> (sample to edit at, stop, clip) or None where no clip fits
+def table(positions, make, spacing):
+    out = {'positions': [], 'stops': [], 'clips': [], 'spacing': int(spacing)}
+    for p in positions:
+        made = make(p)
+        if made is None:
+            continue
+        at, stop, clip = made
+        out['positions'].append(at)
+        out['stops'].append(stop)
+        out['clips'].append(audio_io.to_int16(clip))
+    out['positions'] = np.array(out['positions'], dtype=int)
+    out['stops'] = np.array(out['stops'], dtype=int)
+    return out
+
+# (position, stop, clip) of the first clip for level at or after earliest
+# (start if not given), None if there is none within a grid step of start
+def lookup(param_dict, level, start, earliest=None):
+    levels = param_dict.get('variants')
+    if levels is None or level not in levels:
+        return None
+
+    t = levels[level]
+    i = np.searchsorted(t['positions'], start if earliest is None else earliest)
+    if i == len(t['positions']) or t['positions'][i] - start > t['spacing']:
+        return None
+    return t['positions'][i], t['stops'][i], t['clips'][i]
+
+# bytes held by a param dict's variants
+def size(param_dict):
+    levels = param_dict.get('variants', {})
+    return sum(sum(c.nbytes for c in t['clips']) for t in levels.values())
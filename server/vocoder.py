@@ -0,0 +1,170 @@
+#####################################
+# Music Signaling Pipeline Prototype
+#   Vocoder: phase vocoder pitch
+#   shifting and time stretching that
+#   can start from a track's stored STFT
+#
+# Author: Ishwarya Ananthabhotla
+######################################
+
+# librosa.effects.pitch_shift takes the STFT of its input, time stretches it
+# with the phase vocoder and resamples the result back to the original
+# length; librosa.effects.time_stretch stops before the resample. Here the
+# same steps can start from frames of a whole-track STFT kept in
+# param_dict['stft'], so only the phase vocoder, the inverse STFT and the
+# resample run at signal time. Quality picks the resampler:
+#   'high': the band-limited kaiser_best resampler librosa uses
+#   'fast': linear interpolation, much cheaper; when downsampling, a short
+#           FIR low-pass runs first so the highs roll off instead of
+#           aliasing back down
+# The stored STFT is of the mono analysis audio (22050 Hz); the frames are
+# on a fixed grid of HOP samples from the start of the trimmed track.
+
+import librosa
+import numpy as np
+
+import audio_io
+import windows
+
+N_FFT = 2048
+HOP = 512
+
+QUALITY = ['high', 'fast']
+quality = 'high'
+
+# int16 phase steps per radian
+PHASE_SCALE = np.iinfo(np.int16).max / np.pi
+
+# compressed storage: magnitude in uint8 steps over this many dB below the
+# track's loudest bin, phase in uint8 steps around the circle
+COMPRESSED_DB = 80.0
+
+
+def stft(y):
+    return librosa.stft(y, n_fft=N_FFT, hop_length=HOP)
+
+# signal time stretched by rate (> 1 is faster) from stft frames
+def stretch(D, rate):
+    return librosa.istft(librosa.phase_vocoder(D, rate, hop_length=HOP), hop_length=HOP, dtype=np.float32)
+
+# windowed-sinc low-pass, cutoff a fraction of nyquist, unit gain at DC
+def lowpass(cutoff, taps=63):
+    def make():
+        n = np.arange(taps) - (taps - 1) / 2.0
+        h = cutoff * np.sinc(cutoff * n) * np.hanning(taps)
+        return h / np.sum(h)
+    return windows.cached(('lowpass', taps, round(cutoff, 4)), make)
+
+def resample(y, orig_sr, target_sr, q=None):
+    if (q or quality) == 'high':
+        return librosa.resample(y, orig_sr, target_sr, res_type=audio_io.res_type('best'))
+    if target_sr < orig_sr:
+        y = np.convolve(y, lowpass(float(target_sr) / orig_sr), mode='same')
+    n = int(np.ceil(len(y) * float(target_sr) / orig_sr))
+    return np.interp(np.arange(n) * (float(orig_sr) / target_sr), np.arange(len(y)), y).astype(np.float32)
+
+# length samples of y shifted by n_steps semitones. frames=(D, offset) reuses
+# stored stft frames, offset being the samples from the first frame to y[0]
+def pitch_shift(y, sr, n_steps, frames=None, q=None):
+    rate = 2.0 ** (-float(n_steps) / 12)
+    if frames is None:
+        frames = (stft(y), 0)
+    D, offset = frames
+
+    y_shift = resample(stretch(D, rate), float(sr) / rate, sr, q)
+    return librosa.util.fix_length(y_shift[offset:], len(y))
+
+# y played rate times faster, len(y) / rate samples; frames as for pitch_shift
+def time_stretch(y, rate, frames=None):
+    if frames is None:
+        frames = (stft(y), 0)
+    D, offset = frames
+
+    start = int(round(offset / rate))
+    return librosa.util.fix_length(stretch(D, rate)[start:], int(round(len(y) / rate)))
+
+
+###################################
+# STORED STFT
+###################################
+
+# whole-track stft for param_dict['stft']: float16 magnitude and int16
+# phase, half the size of the complex64 frames, or with compress uint8 of
+# each (a quarter of the size)
+def store(y, compress=False):
+    D = stft(y)
+    mag = np.abs(D)
+    if not compress:
+        return {'mag': mag.astype(np.float16),
+                'phase': np.round(np.angle(D) * PHASE_SCALE).astype(np.int16)}
+
+    db = 20.0 * np.log10(np.maximum(mag, 1e-10))
+    top = float(db.max())
+    return {'top_db': top,
+            'mag': np.round(np.clip((db - top + COMPRESSED_DB) * (255.0 / COMPRESSED_DB), 0, 255)).astype(np.uint8),
+            'phase': (np.round((np.angle(D) + np.pi) * (256.0 / (2 * np.pi))).astype(int) % 256).astype(np.uint8)}
+
+# (complex64 frames covering samples [start, stop), samples from the first
+# frame to start) out of a stored stft
+def frames(stored, start, stop):
+    f0 = int(start // HOP)
+    f1 = min(stored['mag'].shape[1], int(-(-stop // HOP)) + 1)
+    mag = stored['mag'][:, f0:f1]
+    phase = stored['phase'][:, f0:f1]
+
+    if mag.dtype == np.uint8:
+        # the bottom step stands for silence
+        db = mag * np.float32(COMPRESSED_DB / 255.0) + np.float32(stored['top_db'] - COMPRESSED_DB)
+        mag = np.where(mag > 0, 10.0 ** (db / 20.0), 0.0).astype(np.float32)
+        phase = phase * np.float32(2 * np.pi / 256.0) - np.float32(np.pi)
+    else:
+        mag = mag.astype(np.float32)
+        phase = phase * np.float32(1.0 / PHASE_SCALE)
+    return (mag * np.exp(1j * phase)).astype(np.complex64), int(start - f0 * HOP)
+
+
+if __name__ == "__main__":
+    import time
+
+    # speed and spectral similarity against librosa.effects.pitch_shift and
+    # time_stretch on a clip taken from the middle of a synthetic track
+    sr = 22050
+    rng = np.random.RandomState(0)
+    t = np.arange(60 * sr) / float(sr)
+    track = (sum(np.sin(2 * np.pi * f * t) / k for k, f in enumerate([220.0, 330.0, 440.0, 660.0], 1)) / 4.0 +
+        0.01 * rng.randn(len(t))).astype(np.float32)
+    stored = store(track)
+    compressed = store(track, compress=True)
+    start = 30 * sr + 123
+    clip = track[start: start + 4 * sr]
+
+    def similarity(reference, y):
+        a, b = np.abs(stft(reference)).ravel(), np.abs(stft(y)).ravel()
+        return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
+
+    def timed(f, runs=5):
+        start_time = time.time()
+        for i in range(runs):
+            y = f()
+        return y, (time.time() - start_time) / runs
+
+    reference, base = timed(lambda: librosa.effects.pitch_shift(clip, sr, n_steps=4))
+    print "librosa.effects.pitch_shift: %.4fs" % base
+
+    for q in QUALITY:
+        for name, f in [('fresh stft', lambda: pitch_shift(clip, sr, 4, q=q)),
+                        ('stored stft', lambda: pitch_shift(clip, sr, 4, frames(stored, start, start + len(clip)), q=q))]:
+            y, secs = timed(f)
+            print "%s, %s: %.4fs (%.1fx), spectral similarity %.4f" % (q, name, secs, base / secs, similarity(reference, y))
+
+    # classical level 1 stretches 4-8 second clips by 1.3 to 1.8
+    clip = track[start: start + 6 * sr]
+    reference, base = timed(lambda: librosa.effects.time_stretch(clip, 1.5))
+    print "librosa.effects.time_stretch: %.4fs" % base
+
+    for name, f in [('fresh stft', lambda: time_stretch(clip, 1.5)),
+                    ('stored stft', lambda: time_stretch(clip, 1.5, frames(stored, start, start + len(clip)))),
+                    ('compressed stft', lambda: time_stretch(clip, 1.5, frames(compressed, start, start + len(clip))))]:
+        y, secs = timed(f)
+        y = librosa.util.fix_length(y, len(reference))
+        print "%s: %.4fs (%.1fx), spectral similarity %.4f" % (name, secs, base / secs, similarity(reference, y))
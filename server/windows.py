@@ -0,0 +1,84 @@
+#####################################
+# Music Signaling Pipeline Prototype
+#   Windows: fades and windows shared
+#   by the modifiers and the jukebox
+#
+# Author: Ishwarya Ananthabhotla
+######################################
+
+# Every table is built once with numpy and kept in a small LRU cache keyed by
+# (shape, length, endpoints), so applying a window is a single multiply.
+# Cached tables are shared and marked read-only; copy one before changing it.
+
+import collections
+import threading
+
+import numpy as np
+from scipy import signal
+
+CACHE_SIZE = 128
+
+_cache = collections.OrderedDict()
+_lock = threading.Lock()
+
+
+# the table for key, built by make() on a miss
+def cached(key, make):
+    with _lock:
+        if key in _cache:
+            table = _cache.pop(key)
+            _cache[key] = table
+            return table
+
+    table = np.asarray(make(), dtype=np.float32)
+    table.flags.writeable = False
+
+    with _lock:
+        _cache[key] = table
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return table
+
+# length samples going linearly from start towards end (end itself excluded)
+def ramp(length, start, end):
+    return cached(('ramp', length, (start, end)),
+        lambda: start + ((end - start) / float(length)) * np.arange(length))
+
+def gaussian(length):
+    return cached(('gaussian', length, ()),
+        lambda: signal.gaussian(length, std=(2.0 * length / 8.0)))
+
+#  ___
+# /   \
+#
+# ramps over the first and last eighth of length
+def trapezoid(length, high_end=1.0, low_end=0.5):
+    def make():
+        fade_samples = int(length * (1.0 / 8.0))
+        w = np.full(length, high_end, dtype=np.float32)
+        if fade_samples > 0:
+            w[:fade_samples] = ramp(fade_samples, low_end, high_end)
+            w[-fade_samples:] = ramp(fade_samples, high_end, low_end)
+        return w
+    return cached(('trapezoid', length, (high_end, low_end)), make)
+
+# sig times win; sig may be (n, channels) frames. out=sig windows in place
+def apply(sig, win, out=None):
+    if sig.ndim > 1:
+        win = win[:, np.newaxis]
+    return np.multiply(sig, win, out=out)
+
+
+if __name__ == "__main__":
+    import time
+
+    sig = np.random.randn(22050).astype(np.float32)
+    for name, make in [('trapezoid', trapezoid), ('gaussian', gaussian)]:
+        start_time = time.time()
+        make(len(sig))
+        first = time.time() - start_time
+
+        start_time = time.time()
+        for i in range(100):
+            apply(sig, make(len(sig)))
+        print "%s: first %.5fs, cached %.5fs per window" % (name, first, (time.time() - start_time) / 100)